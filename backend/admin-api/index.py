@@ -1,9 +1,70 @@
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
 
+# psycopg2 импортируется лениво — OPTIONS-запросы и холодный старт обходятся без него
+
+
+# Действия только на чтение — их можно выполнять на реплике
+READ_ONLY_ACTIONS = {'stats', 'users', 'search', 'matches', 'messages'}
+
+# Запрос отставания реплики в секундах; NULL — отставание определить нельзя.
+# Совпадение принятого и примененного LSN говорит о свежести, только пока WAL receiver
+# подключен к основной базе: отключенная реплика тоже "все применила", но безнадежно отстала.
+# Статус WAL receiver виден ролям с pg_read_all_stats (pg_monitor); без нее реплика не используется
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END AS lag
+"""
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '30'))
+
+# Сколько ближайших совпадений берется из каждого индекса поиска. Ранжируются и листаются
+# только они: вместо сотен тысяч анкет с именем "Анна" модератор уточняет запрос
+SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', '50'))
+
+# Ранжированный поиск анкет: запрос с параметрами q, candidates, after_score, after_id, limit.
+# Кандидаты: ближайшие по имени и username (GiST), новые анкеты города и анкеты со всеми словами
+# запроса (GIN). plainto_tsquery с явной конфигурацией вычисляется при планировании — планировщик
+# видит, сколько анкет совпадет
+USER_SEARCH_QUERY = """
+    WITH candidates AS (
+        (SELECT id FROM users WHERE %(q)s <%% first_name ORDER BY first_name <->> %(q)s LIMIT %(candidates)s)
+        UNION
+        (SELECT id FROM users WHERE %(q)s <%% username ORDER BY username <->> %(q)s LIMIT %(candidates)s)
+        UNION
+        (SELECT id FROM users WHERE %(q)s <%% city ORDER BY id DESC LIMIT %(candidates)s)
+        UNION
+        (SELECT id FROM users WHERE search_vector @@ plainto_tsquery('simple', %(q)s) ORDER BY id DESC LIMIT %(candidates)s)
+    )
+    SELECT * FROM (
+        SELECT u.id, u.telegram_id, u.username, u.first_name, u.age, u.gender, u.city, u.bio,
+               u.photo_url, u.status, u.verified, u.created_at,
+               (ts_rank(u.search_vector, plainto_tsquery('simple', %(q)s)) + GREATEST(
+                   word_similarity(%(q)s, coalesce(u.first_name, '')),
+                   word_similarity(%(q)s, coalesce(u.username, '')),
+                   word_similarity(%(q)s, coalesce(u.city, ''))
+               ))::float8 AS score
+        FROM candidates c
+        JOIN users u ON u.id = c.id
+    ) found
+    WHERE %(after_score)s::float8 IS NULL OR (score, id) < (%(after_score)s::float8, %(after_id)s::int)
+    ORDER BY score DESC, id DESC
+    LIMIT %(limit)s
+"""
+
+# Действия модерации: изменение пользователя и сообщение для ответа
+MODERATION_ACTIONS = {
+    'approve': ("verified = TRUE, status = 'active'", 'User approved'),
+    'reject': ("status = 'banned'", 'User rejected'),
+}
+
+# Диапазон users.id (SERIAL, int4)
+USER_ID_MAX = 2147483647
+
 
 def handler(event: dict, context) -> dict:
     """API для админ-панели LeoMatch - получение статистики и управление пользователями"""
@@ -25,7 +86,7 @@ def handler(event: dict, context) -> dict:
         }
     
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(readonly=method == 'GET' and action in READ_ONLY_ACTIONS)
         
         # Получение статистики для дашборда
         if method == 'GET' and action == 'stats':
@@ -38,6 +99,24 @@ def handler(event: dict, context) -> dict:
             users = get_users(conn, status)
             return response(200, {'users': users})
         
+        # Поиск пользователей по имени, username, городу и описанию
+        elif method == 'GET' and action == 'search':
+            query = params.get('q', '').strip()
+            if not query:
+                return response(400, {'error': 'Search query is required'})
+            try:
+                limit = max(1, min(int(params.get('limit', 50)), 100))
+                after_score = float(params['after_score']) if params.get('after_score') is not None else None
+                after_id = int(params['after_id']) if params.get('after_id') is not None else None
+            except ValueError:
+                return response(400, {'error': 'limit, after_score and after_id must be numbers'})
+            if (after_score is None) != (after_id is None):
+                return response(400, {'error': 'after_score and after_id must be passed together'})
+            if after_id is not None and not 0 <= after_id <= USER_ID_MAX:
+                return response(400, {'error': 'after_id is out of range'})
+            result = search_users(conn, query, limit, after_score, after_id)
+            return response(200, result)
+        
         # Получение матчей
         elif method == 'GET' and action == 'matches':
             matches = get_matches(conn)
@@ -57,6 +136,15 @@ def handler(event: dict, context) -> dict:
             result = moderate_user(conn, user_id, mod_action)
             return response(200, result)
         
+        # Массовая модерация пользователей
+        elif method == 'POST' and action == 'bulk_moderate':
+            body = json.loads(event.get('body', '{}'))
+            items = body.get('items', []) if isinstance(body, dict) else None  # [{'user_id': 1, 'action': 'approve'}, ...]
+            if not isinstance(items, list):
+                return response(400, {'error': 'items must be a list'})
+            result = bulk_moderate_users(conn, items)
+            return response(200, result)
+        
         # Обновление статуса пользователя
         elif method == 'PUT' and action == 'update_user':
             body = json.loads(event.get('body', '{}'))
@@ -67,7 +155,7 @@ def handler(event: dict, context) -> dict:
         
         else:
             return response(404, {'error': 'Endpoint not found'})
-        
+    
     except Exception as e:
         print(f"Error: {str(e)}")
         return response(500, {'error': str(e)})
@@ -76,14 +164,37 @@ def handler(event: dict, context) -> dict:
             conn.close()
 
 
-def get_db_connection():
-    """Подключение к базе данных"""
+def get_db_connection(readonly: bool = False):
+    """Подключение к базе данных; чтение (readonly) идёт на реплику, если она настроена и свежая"""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if readonly and replica_url:
+        try:
+            conn = psycopg2.connect(replica_url, cursor_factory=RealDictCursor)
+            if replica_is_fresh(conn):
+                return conn
+            conn.close()
+        except psycopg2.Error as e:
+            print(f"Replica unavailable: {str(e)}")
+    
     return psycopg2.connect(
         os.environ['DATABASE_URL'],
         cursor_factory=RealDictCursor
     )
 
 
+def replica_is_fresh(conn) -> bool:
+    """Проверка, что реплика отстаёт от основной базы не больше допустимого"""
+    cur = conn.cursor()
+    cur.execute(REPLICA_LAG_QUERY)
+    lag = cur.fetchone()['lag']
+    cur.close()
+    conn.rollback()
+    return lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+
+
 def response(status_code: int, data: dict) -> dict:
     """Формирование ответа"""
     return {
@@ -120,7 +231,10 @@ def get_stats(conn) -> dict:
     
     # Сообщения сегодня
     today = datetime.now().date()
-    cur.execute("SELECT COUNT(*) as total FROM messages WHERE DATE(created_at) = %s", (today,))
+    cur.execute(
+        "SELECT COUNT(*) as total FROM messages WHERE created_at >= %s AND created_at < %s",
+        (today, today + timedelta(days=1))
+    )
     messages_today = cur.fetchone()['total']
     
     # Пользователи на модерации
@@ -211,6 +325,29 @@ def get_users(conn, status: str = 'all'):
     return [dict(user) for user in users]
 
 
+def search_users(conn, query: str, limit: int = 50, after_score: float = None, after_id: int = None) -> dict:
+    """Ранжированный поиск пользователей среди лучших кандидатов с keyset-пагинацией по (score, id)"""
+    cur = conn.cursor()
+    
+    # Описание ищется только по словам (search_vector), имя, username и город — еще и с опечатками
+    cur.execute(USER_SEARCH_QUERY, {
+        'q': query,
+        'candidates': SEARCH_CANDIDATES,
+        'after_score': after_score,
+        'after_id': after_id,
+        'limit': limit
+    })
+    
+    users = [dict(user) for user in cur.fetchall()]
+    cur.close()
+    
+    next_page = None
+    if len(users) == limit:
+        next_page = {'after_score': users[-1]['score'], 'after_id': users[-1]['id']}
+    
+    return {'users': users, 'next': next_page}
+
+
 def get_matches(conn):
     """Получение списка матчей"""
     cur = conn.cursor()
@@ -278,28 +415,76 @@ def get_messages(conn, match_id: str = None):
 
 def moderate_user(conn, user_id: int, action: str):
     """Модерация пользователя"""
+    if not isinstance(action, str) or action not in MODERATION_ACTIONS:
+        return {'success': False, 'message': 'Invalid action'}
+    
+    assignments, message = MODERATION_ACTIONS[action]
     cur = conn.cursor()
+    cur.execute(f"""
+        UPDATE users 
+        SET {assignments}
+        WHERE id = %s
+    """, (user_id,))
+    conn.commit()
+    cur.close()
     
-    if action == 'approve':
-        cur.execute("""
-            UPDATE users 
-            SET verified = TRUE, status = 'active'
-            WHERE id = %s
-        """, (user_id,))
-        conn.commit()
-        return {'success': True, 'message': 'User approved'}
-    
-    elif action == 'reject':
-        cur.execute("""
-            UPDATE users 
-            SET status = 'banned'
-            WHERE id = %s
-        """, (user_id,))
-        conn.commit()
-        return {'success': True, 'message': 'User rejected'}
+    return {'success': True, 'message': message}
+
+
+def bulk_moderate_users(conn, items: list):
+    """Массовая модерация: один UPDATE на каждое действие, всё в одной транзакции"""
+    actions = {}
+    errors = {}
+    invalid = []
+    for item in items:
+        if not isinstance(item, dict):
+            invalid.append({'user_id': None, 'success': False, 'message': 'Invalid item'})
+            continue
+        try:
+            user_id = int(item.get('user_id'))
+        except (TypeError, ValueError):
+            user_id = None
+        if user_id is None or not 0 < user_id <= USER_ID_MAX:
+            invalid.append({'user_id': item.get('user_id'), 'success': False, 'message': 'Invalid user_id'})
+            continue
+        if not isinstance(item.get('action'), str) or item['action'] not in MODERATION_ACTIONS:
+            errors[user_id] = 'Invalid action'
+            actions.pop(user_id, None)
+            continue
+        # Если id встречается несколько раз, действует последнее действие
+        actions[user_id] = item['action']
+        errors.pop(user_id, None)
+    
+    ids_by_action = {}
+    for user_id, mod_action in actions.items():
+        ids_by_action.setdefault(mod_action, []).append(user_id)
     
+    cur = conn.cursor()
+    updated = set()
+    for mod_action, user_ids in ids_by_action.items():
+        assignments = MODERATION_ACTIONS[mod_action][0]
+        cur.execute(f"""
+            UPDATE users u
+            SET {assignments}
+            FROM unnest(%s::int[]) AS ids(id)
+            WHERE u.id = ids.id
+            RETURNING u.id
+        """, (user_ids,))
+        updated.update(row['id'] for row in cur.fetchall())
+    conn.commit()
     cur.close()
-    return {'success': False, 'message': 'Invalid action'}
+    
+    results = []
+    for user_id, mod_action in actions.items():
+        if user_id in updated:
+            results.append({'user_id': user_id, 'success': True, 'message': MODERATION_ACTIONS[mod_action][1]})
+        else:
+            results.append({'user_id': user_id, 'success': False, 'message': 'User not found'})
+    for user_id, message in errors.items():
+        results.append({'user_id': user_id, 'success': False, 'message': message})
+    results.extend(invalid)
+    
+    return {'success': True, 'updated': len(updated), 'results': results}
 
 
 def update_user_status(conn, user_id: int, status: str):
@@ -0,0 +1,346 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+from psycopg2.extras import RealDictCursor
+import urllib3
+
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Рассылка дайджестов: размер батча, скорость (лимит Telegram ~30 сообщений в секунду)
+# и время на один запуск — недоотправленное продолжится при следующем запуске
+DIGEST_BATCH_SIZE = int(os.environ.get('DIGEST_BATCH_SIZE', '500'))
+DIGEST_RATE = float(os.environ.get('DIGEST_RATE', '25'))
+DIGEST_WORKERS = int(os.environ.get('DIGEST_WORKERS', '8'))
+JOB_TIME_BUDGET = float(os.environ.get('JOB_TIME_BUDGET', '540'))
+
+# Отступ конца окна дайджеста от начала запуска, секунд. created_at реакции — время начала ее
+# транзакции: лайк, закоммиченный после запроса получателей, но начатый раньше конца окна, иначе
+# не попал бы ни в этот запуск, ни в следующий. Должен превышать самую долгую транзакцию свайпа
+DIGEST_CUTOFF_MARGIN = int(os.environ.get('DIGEST_CUTOFF_MARGIN', '60'))
+
+# Размер батча для фоновых обновлений анкет
+BACKFILL_BATCH_SIZE = int(os.environ.get('BACKFILL_BATCH_SIZE', '1000'))
+
+# Через сколько дней без обновлений анкета уходит из активного пула в 'dormant'
+DORMANCY_DAYS = int(os.environ.get('DORMANCY_DAYS', '30'))
+
+# Через сколько секунд простоя удаляется bucket антифлуда: наполняется он за FLOOD_BURST / FLOOD_RATE
+# секунд (в боте по умолчанию 5), а отсутствующий bucket бот создает сразу полным
+FLOOD_BUCKET_TTL = int(os.environ.get('FLOOD_BUCKET_TTL', '3600'))
+
+# Ответы Bot API, после которых повторять отправку бессмысленно: бот заблокирован, чат не найден
+UNDELIVERABLE_STATUSES = {400, 403}
+
+_http = None
+
+
+def handler(event: dict, context) -> dict:
+    """Плановые задачи бота LeoMatch (запускаются по расписанию)"""
+    
+    params = event.get('queryStringParameters', {}) or {}
+    job = params.get('job')
+    
+    try:
+        conn = get_db_connection()
+        
+        # Дайджест входящих лайков
+        if job == 'digest':
+            result = send_like_digests(conn)
+            return response(200, result)
+        
+        # Заполнение users.city_id по справочнику городов
+        elif job == 'city_backfill':
+            result = backfill_user_cities(conn)
+            return response(200, result)
+        
+        # Перевод давно неактивных анкет в 'dormant'
+        elif job == 'dormancy':
+            result = mark_dormant_users(conn)
+            return response(200, result)
+        
+        # Очистка простаивающих bucket'ов антифлуда (FLOOD_BACKEND=postgres)
+        elif job == 'flood_cleanup':
+            result = prune_flood_buckets(conn)
+            return response(200, result)
+        
+        else:
+            return response(404, {'error': 'Job not found'})
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return response(500, {'error': str(e)})
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+
+def get_db_connection():
+    """Подключение к базе данных"""
+    return psycopg2.connect(
+        os.environ['DATABASE_URL'],
+        cursor_factory=RealDictCursor
+    )
+
+
+def response(status_code: int, data: dict) -> dict:
+    """Формирование ответа"""
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(data, default=str),
+        'isBase64Encoded': False
+    }
+
+
+def telegram_api(method: str, payload: dict):
+    """Вызов метода Telegram Bot API через общий пул соединений (потокобезопасный)"""
+    global _http
+    if _http is None:
+        _http = urllib3.PoolManager(
+            maxsize=DIGEST_WORKERS,
+            timeout=urllib3.Timeout(connect=3.0, read=10.0),
+            retries=False
+        )
+    
+    token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    return _http.request('POST', f"https://api.telegram.org/bot{token}/{method}", json=payload)
+
+
+def send_like_digests(conn) -> dict:
+    """Дайджест «тебя лайкнули»: один запрос на всех получателей, рассылка батчами"""
+    deadline = time.monotonic() + JOB_TIME_BUDGET
+    cur = conn.cursor()
+    
+    # Окно новых лайков: от прошлого полного запуска до начала текущего за вычетом DIGEST_CUTOFF_MARGIN
+    cur.execute(f"SELECT last_run_at FROM {SCHEMA}.job_watermarks WHERE job = 'like_digest'")
+    watermark = cur.fetchone()
+    since = watermark['last_run_at'] if watermark else None
+    cur.execute("SELECT (CURRENT_TIMESTAMP - make_interval(secs => %s))::timestamp AS cutoff", (DIGEST_CUTOFF_MARGIN,))
+    cutoff = cur.fetchone()['cutoff']
+    conn.commit()
+    
+    # Получатели с неотвеченными лайками, о которых еще не было дайджеста.
+    # WITH HOLD: курсор переживает коммиты после каждого батча
+    recipients = conn.cursor('like_digest_recipients', withhold=True)
+    recipients.execute(f"""
+        SELECT u.id, u.telegram_id, COUNT(*) AS likes
+        FROM {SCHEMA}.user_reactions r
+        JOIN {SCHEMA}.users u ON u.id = r.to_user_id
+        WHERE r.reaction_type = 'like'
+        AND r.created_at > COALESCE(%s::timestamp, '-infinity')
+        AND r.created_at <= %s
+        AND r.created_at > COALESCE(u.last_digest_at, '-infinity')
+        AND u.status IN ('active', 'dormant')
+        AND NOT EXISTS (
+            SELECT 1 FROM {SCHEMA}.user_reactions back
+            WHERE back.from_user_id = r.to_user_id AND back.to_user_id = r.from_user_id
+        )
+        GROUP BY u.id, u.telegram_id
+        ORDER BY u.id
+    """, (since, cutoff))
+    
+    total = 0
+    outcome = {'sent': 0, 'undeliverable': 0, 'failed': 0}
+    complete = True
+    while True:
+        batch = recipients.fetchmany(DIGEST_BATCH_SIZE)
+        if not batch:
+            break
+        if time.monotonic() > deadline:
+            complete = False
+            break
+        
+        delivery = send_digest_batch(batch)
+        total += len(batch)
+        for result, ids in delivery.items():
+            outcome[result] += len(ids)
+        
+        # Водяной знак сдвигается одним запросом только тем, кому дайджест доставлен или не будет
+        # доставлен никогда (бот заблокирован); после временной ошибки дайджест уйдет в следующий запуск
+        handled = delivery['sent'] + delivery['undeliverable']
+        if handled:
+            cur.execute(f"UPDATE {SCHEMA}.users SET last_digest_at = %s WHERE id = ANY(%s)", (cutoff, handled))
+            conn.commit()
+    
+    recipients.close()
+    
+    # Общий водяной знак сдвигается только после полного прохода без временных ошибок,
+    # иначе лайки недоставленных дайджестов выпадут из окна следующего запуска
+    if complete and not outcome['failed']:
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.job_watermarks (job, last_run_at)
+            VALUES ('like_digest', %s)
+            ON CONFLICT (job) DO UPDATE SET last_run_at = EXCLUDED.last_run_at
+        """, (cutoff,))
+        conn.commit()
+    
+    cur.close()
+    
+    return {'recipients': total, **outcome, 'complete': complete}
+
+
+def backfill_user_cities(conn) -> dict:
+    """Заполнение city_id для старых анкет батчами по id (каждый батч — отдельная транзакция)"""
+    deadline = time.monotonic() + JOB_TIME_BUDGET
+    cur = conn.cursor()
+    
+    last_id = 0
+    updated = 0
+    complete = False
+    while time.monotonic() < deadline:
+        cur.execute(f"""
+            WITH batch AS (
+                SELECT id FROM {SCHEMA}.users
+                WHERE city_id IS NULL AND city IS NOT NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+            )
+            UPDATE {SCHEMA}.users u
+            SET city_id = ({SCHEMA}.resolve_city(u.city)).id
+            FROM batch
+            WHERE u.id = batch.id
+            RETURNING u.id
+        """, (last_id, BACKFILL_BATCH_SIZE))
+        ids = [row['id'] for row in cur.fetchall()]
+        conn.commit()
+        
+        if not ids:
+            complete = True
+            break
+        
+        last_id = max(ids)
+        updated += len(ids)
+    
+    cur.close()
+    
+    return {'updated': updated, 'complete': complete}
+
+
+def count_active_users(cur) -> int:
+    """Размер активного пула кандидатов (index-only scan по idx_users_active)"""
+    cur.execute(f"SELECT COUNT(*) AS total FROM {SCHEMA}.users WHERE status = 'active'")
+    return cur.fetchone()['total']
+
+
+def mark_dormant_users(conn) -> dict:
+    """Перевод анкет без активности дольше DORMANCY_DAYS в 'dormant' батчами; возвращает размер пула до и после"""
+    deadline = time.monotonic() + JOB_TIME_BUDGET
+    cur = conn.cursor()
+    
+    active_before = count_active_users(cur)
+    conn.commit()
+    
+    last_id = 0
+    dormant = 0
+    complete = False
+    while time.monotonic() < deadline:
+        # Проход по активному пулу батчами по id (idx_users_active): last_seen_at без индекса,
+        # иначе каждая отметка активности в боте обновляла бы индекс и не была бы HOT-обновлением.
+        # SKIP LOCKED: не ждем строки, которые сейчас обновляет бот
+        cur.execute(f"""
+            WITH batch AS (
+                SELECT id FROM {SCHEMA}.users
+                WHERE status = 'active' AND id > %s
+                AND last_seen_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE {SCHEMA}.users u
+            SET status = 'dormant', updated_at = CURRENT_TIMESTAMP
+            FROM batch
+            WHERE u.id = batch.id
+            RETURNING u.id
+        """, (last_id, DORMANCY_DAYS, BACKFILL_BATCH_SIZE))
+        ids = [row['id'] for row in cur.fetchall()]
+        conn.commit()
+        
+        if not ids:
+            complete = True
+            break
+        
+        last_id = max(ids)
+        dormant += len(ids)
+    
+    active_after = count_active_users(cur)
+    conn.commit()
+    cur.close()
+    
+    print(f"Dormancy: active pool {active_before} -> {active_after}, moved {dormant} to dormant")
+    
+    return {
+        'active_before': active_before,
+        'active_after': active_after,
+        'dormant': dormant,
+        'complete': complete
+    }
+
+
+def prune_flood_buckets(conn) -> dict:
+    """Удаление bucket'ов антифлуда, которые не обновлялись дольше FLOOD_BUCKET_TTL секунд"""
+    cur = conn.cursor()
+    cur.execute(
+        f"DELETE FROM {SCHEMA}.flood_buckets WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (FLOOD_BUCKET_TTL,)
+    )
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    
+    return {'deleted': deleted}
+
+
+def send_digest_batch(recipients: list) -> dict:
+    """Рассылка батча с ограничением скорости; возвращает id получателей по результату отправки"""
+    interval = 1.0 / DIGEST_RATE
+    next_at = time.monotonic()
+    futures = []
+    
+    with ThreadPoolExecutor(max_workers=DIGEST_WORKERS) as pool:
+        for recipient in recipients:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_at = max(next_at, time.monotonic()) + interval
+            futures.append(pool.submit(send_digest, recipient))
+    
+    delivery = {'sent': [], 'undeliverable': [], 'failed': []}
+    for recipient, future in zip(recipients, futures):
+        delivery[future.result()].append(recipient['id'])
+    return delivery
+
+
+def send_digest(recipient: dict) -> str:
+    """Отправка одного дайджеста: 'sent', 'undeliverable' или 'failed'; при 429 ждем retry_after и пробуем еще раз"""
+    text = f"""💌 <b>Новых симпатий: {recipient['likes']}</b>
+
+Кто-то лайкнул твою анкету! Нажми «🔍 Найти пару», чтобы посмотреть анкеты."""
+    payload = {
+        'chat_id': recipient['telegram_id'],
+        'text': text,
+        'parse_mode': 'HTML'
+    }
+    
+    for _ in range(2):
+        try:
+            resp = telegram_api('sendMessage', payload)
+        except urllib3.exceptions.HTTPError as e:
+            print(f"Digest to {recipient['telegram_id']} failed: {str(e)}")
+            return 'failed'
+        
+        if resp.status == 429:
+            retry_after = json.loads(resp.data).get('parameters', {}).get('retry_after', 1)
+            time.sleep(retry_after)
+            continue
+        
+        if resp.status == 200:
+            return 'sent'
+        if resp.status in UNDELIVERABLE_STATUSES:
+            print(f"Digest to {recipient['telegram_id']} is undeliverable: {resp.status}")
+            return 'undeliverable'
+        return 'failed'
+    
+    return 'failed'
@@ -1,8 +1,253 @@
+import bisect
+import hashlib
 import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import requests
+import sys
+import time
+from collections import OrderedDict
+
+# psycopg2 и urllib3 импортируются лениво: холодный контейнер не платит за них,
+# пока обновлению действительно не нужны база или Bot API
+
+
+SCHEMA = os.environ.get('MAIN_DB_SCHEMA', 'public')
+
+# Ветка подбора кандидата: первая неоцененная активная анкета по id с дополнительным условием
+# (индексы idx_users_active и idx_users_active_city, без сортировки)
+CANDIDATE_BRANCH = f"""(
+            SELECT u.id, u.updated_at FROM {SCHEMA}.users u
+            WHERE u.status = 'active'
+            AND {{condition}}
+            AND u.id != $1
+            AND NOT EXISTS (
+                SELECT 1 FROM {SCHEMA}.user_reactions r
+                WHERE r.from_user_id = $1 AND r.to_user_id = u.id
+            )
+            ORDER BY u.id
+            LIMIT 1
+        )"""
+
+# Горячие запросы бота: схема подставляется один раз при импорте,
+# на каждом соединении пула запрос подготавливается (PREPARE) один раз.
+# Колонки перечислены явно: после ALTER TABLE ... ADD COLUMN подготовленный SELECT *
+# на живом соединении падает с "cached plan must not change result type"
+STATEMENTS = {
+    'user_by_telegram_id': f"""
+        SELECT id, first_name, age, gender, city, city_id, bio, status
+        FROM {SCHEMA}.users WHERE telegram_id = $1
+    """,
+    'user_id_by_telegram_id': f"SELECT id, status FROM {SCHEMA}.users WHERE telegram_id = $1",
+    'reaction_upsert': f"""
+        INSERT INTO {SCHEMA}.user_reactions AS r (from_user_id, to_user_id, reaction_type)
+        VALUES ($1, $2, $3)
+        -- Смена реакции (дизлайк на лайк по старой кнопке) — новая реакция: время обновляется для дайджеста
+        ON CONFLICT (from_user_id, to_user_id) DO UPDATE SET reaction_type = $3,
+            created_at = CASE WHEN r.reaction_type = EXCLUDED.reaction_type THEN r.created_at ELSE CURRENT_TIMESTAMP END
+    """,
+    'mutual_like': f"""
+        SELECT id FROM {SCHEMA}.user_reactions
+        WHERE from_user_id = $1 AND to_user_id = $2 AND reaction_type = 'like'
+    """,
+    # Случайная анкета без ORDER BY RANDOM(): первая неоцененная активная анкета начиная
+    # со случайного id, сначала из того же города ($2 — city_id), затем из любого
+    'next_candidate': f"""
+        WITH pivot AS (
+            SELECT floor(random() * (SELECT max(id) FROM {SCHEMA}.users))::int AS id
+        )
+        {CANDIDATE_BRANCH.format(condition='u.city_id = $2 AND u.id >= (SELECT id FROM pivot)')}
+        UNION ALL
+        {CANDIDATE_BRANCH.format(condition='u.city_id = $2 AND u.id < (SELECT id FROM pivot)')}
+        UNION ALL
+        {CANDIDATE_BRANCH.format(condition='u.id >= (SELECT id FROM pivot)')}
+        UNION ALL
+        {CANDIDATE_BRANCH.format(condition='u.id < (SELECT id FROM pivot)')}
+        LIMIT 1
+    """,
+    'profile_card': f"""
+        SELECT u.id, u.first_name, u.age, u.city, u.bio, u.updated_at,
+               COALESCE(
+                   json_agg(json_build_object('media_type', m.media_type, 'file_id', m.file_id)
+                            ORDER BY m.media_type, m.position) FILTER (WHERE m.id IS NOT NULL),
+                   '[]'
+               ) AS media
+        FROM {SCHEMA}.users u
+        LEFT JOIN {SCHEMA}.user_media m ON m.user_id = u.id
+        WHERE u.id = $1
+        GROUP BY u.id
+    """,
+    'registration_step': f"""
+        WITH state AS (
+            SELECT current_step FROM {SCHEMA}.user_registration_state WHERE telegram_id = $1
+        ),
+        -- resolve_city изменяет справочник: вызывается один раз в CTE, а не на каждую строку cities
+        city AS (
+            SELECT {SCHEMA}.resolve_city($2::text) AS resolved FROM state WHERE current_step = 'city'
+        ),
+        updated AS (
+            UPDATE {SCHEMA}.user_registration_state r
+            SET current_step = CASE s.current_step
+                    WHEN 'age' THEN 'gender'
+                    WHEN 'gender' THEN 'city'
+                    WHEN 'city' THEN 'bio'
+                    ELSE 'photo'
+                END,
+                temp_data = CASE s.current_step
+                    -- Город нормализуется по справочнику: сохраняем каноническое название и city_id,
+                    -- а не найденный и не похожий на город текст — как есть, без city_id
+                    WHEN 'city' THEN COALESCE(r.temp_data, '{{}}'::jsonb) || COALESCE(
+                        (SELECT jsonb_build_object('city', (resolved).name, 'city_id', (resolved).id)
+                         FROM city WHERE resolved IS NOT NULL),
+                        jsonb_build_object('city', left($2::text, 255))
+                    )
+                    ELSE jsonb_set(
+                        COALESCE(r.temp_data, '{{}}'::jsonb),
+                        ARRAY[s.current_step::text],
+                        CASE s.current_step
+                            WHEN 'age' THEN to_jsonb($3::int)
+                            WHEN 'gender' THEN to_jsonb($4::text)
+                            ELSE to_jsonb($2::text)
+                        END
+                    )
+                END,
+                updated_at = CURRENT_TIMESTAMP
+            FROM state s
+            WHERE r.telegram_id = $1
+            AND s.current_step IN ('age', 'gender', 'city', 'bio')
+            AND (s.current_step != 'age' OR $3::int IS NOT NULL)
+            RETURNING r.current_step
+        )
+        SELECT s.current_step AS step, (SELECT current_step FROM updated) AS next_step
+        FROM state s
+    """,
+    'media_upload': f"""
+        WITH state AS (
+            SELECT current_step FROM {SCHEMA}.user_registration_state WHERE telegram_id = $1
+        ),
+        owner AS (
+            SELECT id FROM {SCHEMA}.users WHERE telegram_id = $1
+        ),
+        counts AS (
+            SELECT COUNT(*) FILTER (WHERE m.media_type = 'photo') AS photos,
+                   COUNT(*) FILTER (WHERE m.media_type = 'video') AS videos
+            FROM {SCHEMA}.user_media m
+            WHERE m.user_id = (SELECT id FROM owner)
+        ),
+        inserted AS (
+            INSERT INTO {SCHEMA}.user_media (user_id, media_type, file_id, position)
+            SELECT o.id, $2::varchar, $3::varchar, CASE WHEN $2::varchar = 'photo' THEN c.photos ELSE 0 END
+            FROM owner o, counts c, state s
+            WHERE ($2::varchar = 'photo' AND s.current_step = 'photo' AND c.photos < 2)
+            OR ($2::varchar = 'video' AND s.current_step IN ('photo', 'video') AND c.videos < 1)
+            RETURNING user_id
+        ),
+        touched AS (
+            UPDATE {SCHEMA}.users SET updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT user_id FROM inserted)
+        )
+        SELECT s.current_step AS step, (SELECT id FROM owner) AS user_id, c.photos, c.videos,
+               EXISTS (SELECT 1 FROM inserted) AS inserted
+        FROM state s, counts c
+    """,
+    'finish_registration': f"""
+        WITH finished AS (
+            DELETE FROM {SCHEMA}.user_registration_state WHERE telegram_id = $1
+            RETURNING temp_data
+        ),
+        activated AS (
+            UPDATE {SCHEMA}.users u
+            SET age = (f.temp_data->>'age')::int,
+                gender = f.temp_data->>'gender',
+                city = f.temp_data->>'city',
+                city_id = (f.temp_data->>'city_id')::int,
+                bio = f.temp_data->>'bio',
+                status = 'active',
+                updated_at = CURRENT_TIMESTAMP
+            FROM finished f
+            WHERE u.telegram_id = $1
+            RETURNING u.id
+        )
+        SELECT (SELECT id FROM activated) AS user_id
+        FROM finished
+    """,
+    # Отметка активности: запись только если прошлая отметка старше $2 секунд
+    'touch_last_seen': f"""
+        UPDATE {SCHEMA}.users SET last_seen_at = CURRENT_TIMESTAMP
+        WHERE telegram_id = $1
+        AND (last_seen_at IS NULL OR last_seen_at < CURRENT_TIMESTAMP - make_interval(secs => $2::float8))
+    """,
+    'flood_take_token': f"""
+        INSERT INTO {SCHEMA}.flood_buckets AS b (telegram_id, tokens, allowed, updated_at)
+        VALUES ($1, $2::float8 - 1, TRUE, CURRENT_TIMESTAMP)
+        ON CONFLICT (telegram_id) DO UPDATE SET (tokens, allowed, updated_at) = (
+            SELECT refill - CASE WHEN refill >= 1 THEN 1 ELSE 0 END, refill >= 1, CURRENT_TIMESTAMP
+            FROM (
+                SELECT LEAST($2::float8, b.tokens + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - b.updated_at)::float8 * $3::float8) AS refill
+            ) r
+        )
+        RETURNING allowed
+    """,
+}
+
+# Запрос отставания реплики в секундах; NULL — отставание определить нельзя.
+# Совпадение принятого и примененного LSN говорит о свежести, только пока WAL receiver
+# подключен к основной базе: отключенная реплика тоже "все применила", но безнадежно отстала.
+# Статус WAL receiver виден ролям с pg_read_all_stats (pg_monitor); без нее реплика не используется
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END AS lag
+"""
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', '10'))
+
+# Антифлуд: token bucket на каждого пользователя (from.id)
+FLOOD_RATE = float(os.environ.get('FLOOD_RATE', '1'))  # токенов в секунду
+FLOOD_BURST = float(os.environ.get('FLOOD_BURST', '5'))  # размер bucket'а
+FLOOD_BACKEND = os.environ.get('FLOOD_BACKEND', 'memory')  # 'memory' или 'postgres' для нескольких экземпляров
+FLOOD_MAX_TRACKED = 10000
+FLOOD_STATS = {'allowed': 0, 'shed': 0}
+
+# Ограничения Telegram на длину текста сообщения и подписи к медиа
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+TELEGRAM_STATS = {'updates': 0, 'calls': 0}
+
+# Учет активности: users.last_seen_at пишется не чаще раза в LAST_SEEN_INTERVAL секунд
+LAST_SEEN_INTERVAL = float(os.environ.get('LAST_SEEN_INTERVAL', '300'))
+LAST_SEEN_MAX_TRACKED = 10000
+
+_flood_buckets = OrderedDict()
+_deferred_replies = {}
+_last_seen = {}
+
+# LRU-кэш отрисованных карточек анкет: user_id -> подпись, медиа и клавиатура.
+# Карточка действительна, пока совпадает версия (users.updated_at)
+PROFILE_CACHE_MAX_BYTES = int(os.environ.get('PROFILE_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+PROFILE_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+_profile_cards = OrderedDict()
+# Шардированный режим: обновления одного пользователя всегда обрабатывает один воркер,
+# чтобы его локальные кэши оставались теплыми. BOT_SHARD_WORKERS — список воркеров
+# вида "w1=http://127.0.0.1:8001,w2=http://127.0.0.1:8002", BOT_WORKER_ID — имя текущего
+SHARD_WORKERS = dict(
+    item.strip().split('=', 1) for item in os.environ.get('BOT_SHARD_WORKERS', '').split(',') if '=' in item
+)
+SHARD_WORKER_ID = os.environ.get('BOT_WORKER_ID')
+SHARD_VNODES = 64  # виртуальных узлов на воркер: ровнее распределение при ребалансировке
+SHARD_RETRY_AFTER = 30.0  # сколько секунд недоступный воркер исключен из кольца
+SHARD_FORWARD_HEADER = 'X-LeoMatch-Shard'
+SHARD_HANDLED_BY_HEADER = 'X-LeoMatch-Worker'  # в ответе: какой воркер обработал обновление
+
+_shard_ring = []
+_shard_down = {}
+_db_pools = {}
+_borrowed_connections = {}
+_connection_class = None
+_http = None
+_replica_state = {'fresh': False, 'checked_at': None}
 
 
 def handler(event: dict, context) -> dict:
@@ -30,16 +275,33 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
+    _deferred_replies.clear()
+    
     try:
         body = json.loads(event.get('body', '{}'))
+        callback_query = body.get('callback_query')
+        message = body.get('message', {})
+        
+        sender_id = (callback_query or message or {}).get('from', {}).get('id')
+        
+        # Шардирование: обновление обрабатывает воркер-владелец пользователя
+        if sender_id and SHARD_WORKERS and not is_forwarded(event):
+            forwarded = forward_to_owner(sender_id, event.get('body', '{}'))
+            if forwarded:
+                return forwarded
+        
+        # Антифлуд: отсекаем лишние обновления до обработчиков и обращений к базе
+        if sender_id and not allow_update(sender_id):
+            return shed_update(callback_query)
+        
+        if sender_id:
+            touch_last_seen(sender_id)
         
         # Обработка callback_query (нажатия на кнопки)
-        callback_query = body.get('callback_query')
         if callback_query:
             return handle_callback(callback_query)
         
         # Обработка сообщений
-        message = body.get('message', {})
         if not message:
             return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
         
@@ -79,20 +341,370 @@ def handler(event: dict, context) -> dict:
             'body': json.dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
+    finally:
+        release_all_connections()
+        try:
+            flush_deferred_replies()
+        except Exception as e:
+            print(f"Error: {str(e)}")
+        count_update()
 
 
-def get_db_connection():
-    """Подключение к базе данных"""
-    return psycopg2.connect(
-        os.environ['DATABASE_URL'],
-        cursor_factory=RealDictCursor
+def take_flood_token(telegram_id: int) -> bool:
+    """In-process token bucket: True, если у пользователя есть токен на обновление"""
+    now = time.monotonic()
+    bucket = _flood_buckets.get(telegram_id)
+    if bucket is None:
+        bucket = _flood_buckets[telegram_id] = [FLOOD_BURST, now]
+        # LRU: вытесняем давно не писавших пользователей — их bucket'ы почти наверняка полные
+        while len(_flood_buckets) > FLOOD_MAX_TRACKED:
+            _flood_buckets.popitem(last=False)
+    else:
+        _flood_buckets.move_to_end(telegram_id)
+    
+    tokens = min(FLOOD_BURST, bucket[0] + (now - bucket[1]) * FLOOD_RATE)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        return False
+    bucket[0] = tokens - 1
+    return True
+
+
+def allow_update(telegram_id: int) -> bool:
+    """Антифлуд: сначала локальный bucket, затем (если включен) общий bucket в Postgres"""
+    allowed = take_flood_token(telegram_id)
+    
+    if allowed and FLOOD_BACKEND == 'postgres':
+        conn = get_db_connection()
+        cur = conn.cursor()
+        execute_prepared(cur, 'flood_take_token', (telegram_id, FLOOD_BURST, FLOOD_RATE))
+        allowed = cur.fetchone()['allowed']
+        conn.commit()
+        cur.close()
+        release_db_connection(conn)
+    
+    FLOOD_STATS['allowed' if allowed else 'shed'] += 1
+    return allowed
+
+
+def touch_last_seen(telegram_id: int):
+    """Отметка активности пользователя, схлопнутая в памяти до одной записи за интервал"""
+    now = time.monotonic()
+    seen_at = _last_seen.get(telegram_id)
+    if seen_at is not None and now - seen_at < LAST_SEEN_INTERVAL:
+        return
+    
+    if seen_at is None and len(_last_seen) >= LAST_SEEN_MAX_TRACKED:
+        # Забываем отметки, интервал которых уже истек
+        for key, marked_at in list(_last_seen.items()):
+            if now - marked_at >= LAST_SEEN_INTERVAL:
+                del _last_seen[key]
+    _last_seen[telegram_id] = now
+    
+    # Условие в запросе схлопывает записи и между экземплярами бота
+    conn = get_db_connection()
+    cur = conn.cursor()
+    execute_prepared(cur, 'touch_last_seen', (telegram_id, LAST_SEEN_INTERVAL))
+    conn.commit()
+    cur.close()
+    release_db_connection(conn)
+
+
+def shed_update(callback_query: dict = None) -> dict:
+    """Дешевый ответ на отсеченное обновление: тост для кнопок, сообщения просто схлопываются"""
+    if callback_query:
+        answer_callback_query(callback_query.get('id'), "⏳ Слишком часто! Подожди пару секунд")
+    
+    if FLOOD_STATS['shed'] % 100 == 1:
+        print(f"Flood control: shed {FLOOD_STATS['shed']} of {FLOOD_STATS['shed'] + FLOOD_STATS['allowed']} updates")
+    
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
+
+
+def shard_hash(key: str) -> int:
+    """Стабильный хэш для кольца консистентного хэширования"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+def build_shard_ring(worker_ids) -> list:
+    """Кольцо консистентного хэширования: SHARD_VNODES точек на каждого воркера"""
+    # При добавлении или удалении воркера переезжают только пользователи его участков кольца
+    return sorted(
+        (shard_hash(f"{worker_id}#{vnode}"), worker_id)
+        for worker_id in worker_ids
+        for vnode in range(SHARD_VNODES)
     )
 
 
+def shard_owner(telegram_id: int, ring: list, down=()) -> str:
+    """Воркер-владелец пользователя: первая точка кольца по часовой стрелке, минуя недоступных"""
+    if not ring:
+        return None
+    
+    start = bisect.bisect(ring, (shard_hash(str(telegram_id)),))
+    for offset in range(len(ring)):
+        worker_id = ring[(start + offset) % len(ring)][1]
+        if worker_id not in down:
+            return worker_id
+    return None
+
+
+def is_forwarded(event: dict) -> bool:
+    """Обновление уже пришло от роутера — обрабатываем здесь, не пересылая дальше"""
+    headers = event.get('headers') or {}
+    return any(name.lower() == SHARD_FORWARD_HEADER.lower() for name in headers)
+
+
+def forward_to_owner(telegram_id: int, raw_body: str):
+    """Пересылка обновления воркеру-владельцу; None — обработать в текущем процессе"""
+    import urllib3
+    
+    global _shard_ring
+    if not _shard_ring:
+        _shard_ring = build_shard_ring(SHARD_WORKERS)
+    
+    now = time.monotonic()
+    for worker_id, until in list(_shard_down.items()):
+        if until <= now:
+            del _shard_down[worker_id]
+    
+    while True:
+        owner = shard_owner(telegram_id, _shard_ring, _shard_down)
+        if owner is None or owner == SHARD_WORKER_ID:
+            return None
+        
+        try:
+            resp = get_http().request(
+                'POST',
+                SHARD_WORKERS[owner],
+                body=raw_body.encode(),
+                headers={'Content-Type': 'application/json', SHARD_FORWARD_HEADER: SHARD_WORKER_ID or 'router'}
+            )
+        except urllib3.exceptions.ConnectTimeoutError as e:
+            # Воркер недоступен (соединение не установлено, обновление до него не дошло):
+            # временно исключаем его, пользователи переезжают к соседям по кольцу
+            print(f"Shard worker {owner} unavailable: {str(e)}")
+            _shard_down[owner] = now + SHARD_RETRY_AFTER
+            continue
+        except urllib3.exceptions.HTTPError as e:
+            # Обновление ушло воркеру, но ответа нет (таймаут чтения, обрыв): он мог его уже обработать,
+            # и повторная обработка здесь задвоила бы лайки и сообщения. Отвечаем 200 без обработки
+            print(f"Shard worker {owner} did not answer: {str(e)}")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
+        
+        return {
+            'statusCode': resp.status,
+            'headers': {
+                'Content-Type': 'application/json',
+                SHARD_HANDLED_BY_HEADER: resp.headers.get(SHARD_HANDLED_BY_HEADER, owner)
+            },
+            'body': resp.data.decode(),
+            'isBase64Encoded': False
+        }
+
+
+def get_connection_class():
+    """Класс соединения пула, помнящего подготовленные на нём запросы"""
+    global _connection_class
+    if _connection_class is None:
+        import psycopg2.extensions
+        
+        class PooledConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared = set()
+        
+        _connection_class = PooledConnection
+    return _connection_class
+
+
+def get_db_pool(role: str):
+    """Пул соединений к основной базе ('primary') или к реплике ('replica')"""
+    if role not in _db_pools:
+        from psycopg2.extras import RealDictCursor
+        from psycopg2.pool import SimpleConnectionPool
+        
+        dsn = os.environ['DATABASE_REPLICA_URL'] if role == 'replica' else os.environ['DATABASE_URL']
+        _db_pools[role] = SimpleConnectionPool(
+            1,
+            int(os.environ.get('DB_POOL_SIZE', '4')),
+            dsn,
+            cursor_factory=RealDictCursor,
+            connection_factory=get_connection_class()
+        )
+    return _db_pools[role]
+
+
+def replica_is_fresh() -> bool:
+    """Реплика настроена, доступна и отстаёт не больше допустимого (проверка кэшируется)"""
+    if not os.environ.get('DATABASE_REPLICA_URL'):
+        return False
+    
+    now = time.monotonic()
+    checked_at = _replica_state['checked_at']
+    if checked_at is not None and now - checked_at < REPLICA_CHECK_INTERVAL:
+        return _replica_state['fresh']
+    
+    import psycopg2
+    
+    fresh = False
+    try:
+        pool = get_db_pool('replica')
+        conn = pool.getconn()
+        try:
+            cur = conn.cursor()
+            cur.execute(REPLICA_LAG_QUERY)
+            lag = cur.fetchone()['lag']
+            cur.close()
+            fresh = lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        finally:
+            pool.putconn(conn)
+    except psycopg2.Error as e:
+        print(f"Replica check failed: {str(e)}")
+    
+    _replica_state['fresh'] = fresh
+    _replica_state['checked_at'] = now
+    return fresh
+
+
+def get_db_connection(readonly: bool = False):
+    """Получение соединения из пула; чтение (readonly) идёт на реплику, если она свежая"""
+    # Записи и чтение только что записанных данных всегда идут на основную базу
+    role = 'replica' if readonly and replica_is_fresh() else 'primary'
+    pool = get_db_pool(role)
+    conn = pool.getconn()
+    _borrowed_connections[conn] = pool
+    return conn
+
+
+def fetch_readonly(name: str, params: tuple, cur=None):
+    """Строка горячего запроса с реплики, если она свежая, иначе (и при сбое реплики) — с основной базы через cur или новое соединение"""
+    import psycopg2
+    
+    if replica_is_fresh():
+        replica_conn = None
+        try:
+            replica_conn = get_db_connection(readonly=True)
+            replica_cur = replica_conn.cursor()
+            execute_prepared(replica_cur, name, params)
+            row = replica_cur.fetchone()
+            replica_cur.close()
+            return row
+        except psycopg2.Error as e:
+            # Проверка свежести кэшируется: до следующей проверки читаем с основной базы
+            print(f"Replica read failed: {str(e)}")
+            _replica_state['fresh'] = False
+        finally:
+            if replica_conn is not None:
+                release_db_connection(replica_conn)
+    
+    if cur is not None:
+        execute_prepared(cur, name, params)
+        return cur.fetchone()
+    
+    conn = get_db_connection()
+    try:
+        primary_cur = conn.cursor()
+        execute_prepared(primary_cur, name, params)
+        row = primary_cur.fetchone()
+        primary_cur.close()
+        return row
+    finally:
+        release_db_connection(conn)
+
+
+def release_db_connection(conn):
+    """Возврат соединения в пул (незавершённая транзакция откатывается пулом)"""
+    pool = _borrowed_connections.pop(conn, None)
+    if pool is not None:
+        pool.putconn(conn)
+
+
+def release_all_connections():
+    """Возврат в пул соединений, не освобождённых обработчиком (например, после ошибки)"""
+    for conn in list(_borrowed_connections):
+        release_db_connection(conn)
+
+
+def execute_prepared(cur, name: str, params: tuple = ()):
+    """Выполнение горячего запроса по имени: PREPARE один раз на соединение, затем EXECUTE"""
+    conn = cur.connection
+    if name not in conn.prepared:
+        cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        conn.prepared.add(name)
+    
+    query = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+    try:
+        cur.execute(query, params)
+    except Exception as e:
+        # Схема таблицы изменилась так, что у запроса другой набор колонок (0A000,
+        # "cached plan must not change result type") — подготавливаем его заново.
+        # Горячие запросы выполняются в начале транзакции или после чтений, откат безопасен
+        if getattr(e, 'pgcode', None) != '0A000':
+            raise
+        conn.rollback()
+        cur.execute(f"DEALLOCATE {name}")
+        cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        cur.execute(query, params)
+
+
+def get_http():
+    """Общий keep-alive пул HTTP-соединений (Bot API и пересылка между воркерами)"""
+    global _http
+    if _http is None:
+        import urllib3
+        _http = urllib3.PoolManager(timeout=urllib3.Timeout(connect=3.0, read=10.0), retries=False)
+    return _http
+
+
+def telegram_api(method: str, payload: dict):
+    """Вызов метода Telegram Bot API через общий keep-alive пул соединений"""
+    TELEGRAM_STATS['calls'] += 1
+    token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    return get_http().request('POST', f"https://api.telegram.org/bot{token}/{method}", json=payload)
+
+
+def count_update():
+    """Учет обновлений и вызовов Telegram API (среднее число вызовов на обновление)"""
+    TELEGRAM_STATS['updates'] += 1
+    if TELEGRAM_STATS['updates'] % 100 == 0:
+        print(f"Telegram API: {TELEGRAM_STATS['calls']} calls for {TELEGRAM_STATS['updates']} updates")
+
+
+def defer_message(chat_id: int, text: str):
+    """Короткое уведомление, которое будет добавлено к следующему сообщению в этот чат"""
+    _deferred_replies.setdefault(chat_id, []).append(text)
+
+
+def send_deferred_if_unfit(chat_id: int, text: str, limit: int = MESSAGE_LIMIT):
+    """Отправка отложенных уведомлений отдельным сообщением, если вместе с текстом они не помещаются в лимит"""
+    pending = _deferred_replies.get(chat_id)
+    if pending and len('\n\n'.join(pending + [text])) > limit:
+        del _deferred_replies[chat_id]
+        send_message(chat_id, '\n\n'.join(pending))
+
+
+def merge_deferred(chat_id: int, text: str, limit: int = MESSAGE_LIMIT) -> str:
+    """Добавление отложенных уведомлений перед текстом; не поместившиеся в лимит уходят раньше него"""
+    send_deferred_if_unfit(chat_id, text, limit)
+    
+    pending = _deferred_replies.pop(chat_id, None)
+    if not pending:
+        return text
+    return '\n\n'.join(pending + [text])
+
+
+def flush_deferred_replies():
+    """Отправка отложенных уведомлений, к которым так и не нашлось следующего сообщения"""
+    for chat_id in list(_deferred_replies):
+        texts = _deferred_replies.pop(chat_id)
+        send_message(chat_id, '\n\n'.join(texts))
+
+
 def send_message(chat_id: int, text: str, reply_markup=None):
     """Отправка сообщения через Telegram API"""
-    token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    text = merge_deferred(chat_id, text)
     
     payload = {
         'chat_id': chat_id,
@@ -101,15 +713,15 @@ def send_message(chat_id: int, text: str, reply_markup=None):
     }
     
     if reply_markup:
-        payload['reply_markup'] = json.dumps(reply_markup)
+        payload['reply_markup'] = reply_markup if isinstance(reply_markup, str) else json.dumps(reply_markup)
     
-    requests.post(url, json=payload)
+    telegram_api('sendMessage', payload)
 
 
 def send_photo(chat_id: int, photo_file_id: str, caption: str = '', reply_markup=None):
     """Отправка фото через Telegram API"""
-    token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    url = f"https://api.telegram.org/bot{token}/sendPhoto"
+    if caption:
+        caption = merge_deferred(chat_id, caption, CAPTION_LIMIT)
     
     payload = {
         'chat_id': chat_id,
@@ -119,15 +731,15 @@ def send_photo(chat_id: int, photo_file_id: str, caption: str = '', reply_markup
     }
     
     if reply_markup:
-        payload['reply_markup'] = json.dumps(reply_markup)
+        payload['reply_markup'] = reply_markup if isinstance(reply_markup, str) else json.dumps(reply_markup)
     
-    requests.post(url, json=payload)
+    telegram_api('sendPhoto', payload)
 
 
 def send_video(chat_id: int, video_file_id: str, caption: str = '', reply_markup=None):
     """Отправка видео через Telegram API"""
-    token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    url = f"https://api.telegram.org/bot{token}/sendVideo"
+    if caption:
+        caption = merge_deferred(chat_id, caption, CAPTION_LIMIT)
     
     payload = {
         'chat_id': chat_id,
@@ -137,9 +749,19 @@ def send_video(chat_id: int, video_file_id: str, caption: str = '', reply_markup
     }
     
     if reply_markup:
-        payload['reply_markup'] = json.dumps(reply_markup)
+        payload['reply_markup'] = reply_markup if isinstance(reply_markup, str) else json.dumps(reply_markup)
+    
+    telegram_api('sendVideo', payload)
+
+
+def answer_callback_query(callback_query_id: str, text: str = ''):
+    """Ответ на нажатие inline-кнопки (всплывающее уведомление)"""
+    payload = {'callback_query_id': callback_query_id}
     
-    requests.post(url, json=payload)
+    if text:
+        payload['text'] = text
+    
+    telegram_api('answerCallbackQuery', payload)
 
 
 def handle_start(chat_id: int, user_data: dict) -> dict:
@@ -150,16 +772,15 @@ def handle_start(chat_id: int, user_data: dict) -> dict:
     
     conn = get_db_connection()
     cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
     # Проверяем, есть ли пользователь в БД
-    cur.execute(f"SELECT * FROM {schema}.users WHERE telegram_id = %s", (telegram_id,))
+    execute_prepared(cur, 'user_by_telegram_id', (telegram_id,))
     user = cur.fetchone()
     
     if not user:
         # Создаем нового пользователя
         cur.execute(f"""
-            INSERT INTO {schema}.users (telegram_id, username, first_name, status, verified)
+            INSERT INTO {SCHEMA}.users (telegram_id, username, first_name, status, verified)
             VALUES (%s, %s, %s, 'pending', TRUE)
             RETURNING id
         """, (telegram_id, username, first_name))
@@ -167,7 +788,7 @@ def handle_start(chat_id: int, user_data: dict) -> dict:
         
         # Сохраняем состояние регистрации
         cur.execute(f"""
-            INSERT INTO {schema}.user_registration_state (telegram_id, current_step)
+            INSERT INTO {SCHEMA}.user_registration_state (telegram_id, current_step)
             VALUES (%s, 'age')
             ON CONFLICT (telegram_id) DO UPDATE SET current_step = 'age', updated_at = CURRENT_TIMESTAMP
         """, (telegram_id,))
@@ -183,16 +804,16 @@ def handle_start(chat_id: int, user_data: dict) -> dict:
         
         send_message(chat_id, welcome_text)
     else:
-        if user['status'] == 'paused':
-            # Возобновляем анкету
-            cur.execute(f"UPDATE {schema}.users SET status = 'active' WHERE telegram_id = %s", (telegram_id,))
+        if user['status'] in ['paused', 'dormant']:
+            # Возобновляем анкету (приостановленную вручную или за неактивность)
+            cur.execute(f"UPDATE {SCHEMA}.users SET status = 'active', updated_at = CURRENT_TIMESTAMP WHERE telegram_id = %s", (telegram_id,))
             conn.commit()
-            send_message(chat_id, "✅ Анкета активирована! Можешь начинать поиск.")
+            defer_message(chat_id, "✅ Анкета активирована! Можешь начинать поиск.")
         
         show_main_menu(chat_id)
     
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
@@ -217,91 +838,55 @@ def handle_text(chat_id: int, user_data: dict, text: str) -> dict:
     """Обработка текстовых сообщений"""
     telegram_id = user_data.get('id')
     
+    # Валидация возраста (используется только на шаге 'age')
+    try:
+        age = int(text)
+    except ValueError:
+        age = None
+    valid_age = age if age is not None and 18 <= age <= 100 else None
+    gender = 'male' if '👨' in text or 'муж' in text.lower() else 'female'
+    
     conn = get_db_connection()
     cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
-    # Проверяем состояние регистрации
-    cur.execute(f"SELECT * FROM {schema}.user_registration_state WHERE telegram_id = %s", (telegram_id,))
+    # Шаг регистрации одним запросом: проверка шага, запись ключа в temp_data, переход дальше
+    execute_prepared(cur, 'registration_step', (telegram_id, text, valid_age, gender))
     reg_state = cur.fetchone()
+    conn.commit()
     
-    if reg_state:
-        # Пользователь заполняет анкету
-        step = reg_state['current_step']
-        temp_data = reg_state['temp_data'] or {}
-        
-        if step == 'age':
-            # Валидация возраста
-            try:
-                age = int(text)
-                if age < 18 or age > 100:
-                    send_message(chat_id, "❌ Возраст должен быть от 18 до 100 лет. Попробуй еще раз:")
-                    cur.close()
-                    conn.close()
-                    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
-                
-                temp_data['age'] = age
-                cur.execute(f"""
-                    UPDATE {schema}.user_registration_state 
-                    SET current_step = 'gender', temp_data = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE telegram_id = %s
-                """, (json.dumps(temp_data), telegram_id))
-                conn.commit()
-                
-                keyboard = {
-                    'keyboard': [[{'text': '👨 Мужской'}, {'text': '👩 Женский'}]],
-                    'resize_keyboard': True,
-                    'one_time_keyboard': True
-                }
-                send_message(chat_id, "👫 <b>Выбери свой пол:</b>", keyboard)
-                
-            except ValueError:
-                send_message(chat_id, "❌ Введи возраст цифрами (например: 25)")
-        
-        elif step == 'gender':
-            gender = 'male' if '👨' in text or 'муж' in text.lower() else 'female'
-            temp_data['gender'] = gender
-            cur.execute(f"""
-                UPDATE {schema}.user_registration_state 
-                SET current_step = 'city', temp_data = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE telegram_id = %s
-            """, (json.dumps(temp_data), telegram_id))
-            conn.commit()
-            
-            send_message(chat_id, "🏙 <b>Напиши свой город:</b>\n(например: Москва)")
-        
-        elif step == 'city':
-            temp_data['city'] = text
-            cur.execute(f"""
-                UPDATE {schema}.user_registration_state 
-                SET current_step = 'bio', temp_data = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE telegram_id = %s
-            """, (json.dumps(temp_data), telegram_id))
-            conn.commit()
-            
-            send_message(chat_id, "📝 <b>Расскажи немного о себе:</b>\n(хобби, интересы, чем занимаешься)")
-        
-        elif step == 'bio':
-            temp_data['bio'] = text
-            cur.execute(f"""
-                UPDATE {schema}.user_registration_state 
-                SET current_step = 'photo', temp_data = %s, updated_at = CURRENT_TIMESTAMP
-                WHERE telegram_id = %s
-            """, (json.dumps(temp_data), telegram_id))
-            conn.commit()
-            
-            send_message(chat_id, "📸 <b>Загрузи свои фото</b> (до 2 штук)\n\nОтправь первое фото:")
-        
-        elif step == 'photo' or step == 'video':
-            send_message(chat_id, "📷 Пожалуйста, отправь фото или видео (не текст)")
+    cur.close()
+    release_db_connection(conn)
     
-    else:
+    if not reg_state:
         # Возможно это сообщение в чате с матчем
         # TODO: отправка сообщения в активный чат
         send_message(chat_id, "Используй меню для навигации")
     
-    cur.close()
-    conn.close()
+    elif reg_state['next_step'] == 'gender':
+        keyboard = {
+            'keyboard': [[{'text': '👨 Мужской'}, {'text': '👩 Женский'}]],
+            'resize_keyboard': True,
+            'one_time_keyboard': True
+        }
+        send_message(chat_id, "👫 <b>Выбери свой пол:</b>", keyboard)
+    
+    elif reg_state['next_step'] == 'city':
+        send_message(chat_id, "🏙 <b>Напиши свой город:</b>\n(например: Москва)")
+    
+    elif reg_state['next_step'] == 'bio':
+        send_message(chat_id, "📝 <b>Расскажи немного о себе:</b>\n(хобби, интересы, чем занимаешься)")
+    
+    elif reg_state['next_step'] == 'photo':
+        send_message(chat_id, "📸 <b>Загрузи свои фото</b> (до 2 штук)\n\nОтправь первое фото:")
+    
+    elif reg_state['step'] == 'age':
+        if age is None:
+            send_message(chat_id, "❌ Введи возраст цифрами (например: 25)")
+        else:
+            send_message(chat_id, "❌ Возраст должен быть от 18 до 100 лет. Попробуй еще раз:")
+    
+    elif reg_state['step'] == 'photo' or reg_state['step'] == 'video':
+        send_message(chat_id, "📷 Пожалуйста, отправь фото или видео (не текст)")
     
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
@@ -310,41 +895,36 @@ def handle_media(chat_id: int, user_data: dict, photo, video) -> dict:
     """Обработка загруженных фото/видео"""
     telegram_id = user_data.get('id')
     
+    if photo:
+        media_type, file_id = 'photo', photo[-1]['file_id']  # Берем самое большое фото
+    else:
+        media_type, file_id = 'video', video['file_id']
+    
     conn = get_db_connection()
     cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
-    # Проверяем состояние регистрации
-    cur.execute(f"SELECT * FROM {schema}.user_registration_state WHERE telegram_id = %s", (telegram_id,))
-    reg_state = cur.fetchone()
+    # Загрузка одним запросом: проверка шага и лимитов, вставка медиа, счетчики для ответа
+    execute_prepared(cur, 'media_upload', (telegram_id, media_type, file_id))
+    upload = cur.fetchone()
+    conn.commit()
     
-    if not reg_state:
-        send_message(chat_id, "Сначала начни регистрацию командой /start")
-        cur.close()
-        conn.close()
-        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
+    if upload and upload['inserted']:
+        invalidate_profile_card(upload['user_id'])
     
-    step = reg_state['current_step']
+    cur.close()
+    release_db_connection(conn)
     
-    # Получаем user_id
-    cur.execute(f"SELECT id FROM {schema}.users WHERE telegram_id = %s", (telegram_id,))
-    user = cur.fetchone()
-    if not user:
-        cur.close()
-        conn.close()
+    if not upload:
+        send_message(chat_id, "Сначала начни регистрацию командой /start")
         return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
     
-    user_id = user['id']
-    
-    # Подсчитываем загруженные медиа
-    cur.execute(f"SELECT COUNT(*) as count FROM {schema}.user_media WHERE user_id = %s AND media_type = 'photo'", (user_id,))
-    photo_count = cur.fetchone()['count']
+    if upload['user_id'] is None:
+        return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
     
-    cur.execute(f"SELECT COUNT(*) as count FROM {schema}.user_media WHERE user_id = %s AND media_type = 'video'", (user_id,))
-    video_count = cur.fetchone()['count']
+    step = upload['step']
     
     if photo and step == 'photo':
-        if photo_count >= 2:
+        if not upload['inserted']:
             keyboard = {
                 'inline_keyboard': [[
                     {'text': '✅ Завершить', 'callback_data': 'finish_registration'},
@@ -352,37 +932,21 @@ def handle_media(chat_id: int, user_data: dict, photo, video) -> dict:
                 ]]
             }
             send_message(chat_id, "У тебя уже есть 2 фото. Можешь добавить короткое видео или завершить регистрацию:", keyboard)
+        elif upload['photos'] == 0:
+            send_message(chat_id, "✅ Отлично! Можешь отправить еще одно фото или перейти к видео.")
         else:
-            # Сохраняем фото
-            file_id = photo[-1]['file_id']  # Берем самое большое фото
-            cur.execute(f"""
-                INSERT INTO {schema}.user_media (user_id, media_type, file_id, position)
-                VALUES (%s, 'photo', %s, %s)
-            """, (user_id, file_id, photo_count))
-            conn.commit()
-            
-            if photo_count == 0:
-                send_message(chat_id, "✅ Отлично! Можешь отправить еще одно фото или перейти к видео.")
-            else:
-                keyboard = {
-                    'inline_keyboard': [[
-                        {'text': '✅ Завершить', 'callback_data': 'finish_registration'},
-                        {'text': '🎥 Добавить видео', 'callback_data': 'add_video'}
-                    ]]
-                }
-                send_message(chat_id, "✅ Отлично! Можешь добавить короткое видео или завершить регистрацию:", keyboard)
+            keyboard = {
+                'inline_keyboard': [[
+                    {'text': '✅ Завершить', 'callback_data': 'finish_registration'},
+                    {'text': '🎥 Добавить видео', 'callback_data': 'add_video'}
+                ]]
+            }
+            send_message(chat_id, "✅ Отлично! Можешь добавить короткое видео или завершить регистрацию:", keyboard)
     
     elif video and (step == 'photo' or step == 'video'):
-        if video_count >= 1:
+        if not upload['inserted']:
             send_message(chat_id, "❌ Можно добавить только 1 видео")
         else:
-            file_id = video['file_id']
-            cur.execute(f"""
-                INSERT INTO {schema}.user_media (user_id, media_type, file_id, position)
-                VALUES (%s, 'video', %s, 0)
-            """, (user_id, file_id))
-            conn.commit()
-            
             keyboard = {
                 'inline_keyboard': [[
                     {'text': '✅ Завершить регистрацию', 'callback_data': 'finish_registration'}
@@ -390,9 +954,6 @@ def handle_media(chat_id: int, user_data: dict, photo, video) -> dict:
             }
             send_message(chat_id, "✅ Видео добавлено! Теперь завершим регистрацию:", keyboard)
     
-    cur.close()
-    conn.close()
-    
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
 
@@ -406,33 +967,21 @@ def handle_callback(callback_query: dict) -> dict:
     
     conn = get_db_connection()
     cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
     if data == 'finish_registration':
-        # Завершаем регистрацию
-        cur.execute(f"SELECT * FROM {schema}.user_registration_state WHERE telegram_id = %s", (telegram_id,))
+        # Завершаем регистрацию одним запросом: переносим temp_data в анкету и удаляем состояние
+        execute_prepared(cur, 'finish_registration', (telegram_id,))
         reg_state = cur.fetchone()
+        conn.commit()
         
         if reg_state:
-            temp_data = reg_state['temp_data'] or {}
-            
-            # Обновляем пользователя
-            cur.execute(f"""
-                UPDATE {schema}.users 
-                SET age = %s, gender = %s, city = %s, bio = %s, status = 'active'
-                WHERE telegram_id = %s
-            """, (temp_data.get('age'), temp_data.get('gender'), temp_data.get('city'), temp_data.get('bio'), telegram_id))
-            
-            # Удаляем состояние регистрации
-            cur.execute(f"DELETE FROM {schema}.user_registration_state WHERE telegram_id = %s", (telegram_id,))
-            conn.commit()
-            
-            send_message(chat_id, "🎉 <b>Анкета создана!</b>\n\nТеперь ты можешь искать пару!")
+            invalidate_profile_card(reg_state['user_id'])
+            defer_message(chat_id, "🎉 <b>Анкета создана!</b>\n\nТеперь ты можешь искать пару!")
             show_main_menu(chat_id)
     
     elif data == 'add_video':
         cur.execute(f"""
-            UPDATE {schema}.user_registration_state 
+            UPDATE {SCHEMA}.user_registration_state 
             SET current_step = 'video', updated_at = CURRENT_TIMESTAMP
             WHERE telegram_id = %s
         """, (telegram_id,))
@@ -444,132 +993,179 @@ def handle_callback(callback_query: dict) -> dict:
         reaction_type = 'like' if data.startswith('like_') else 'dislike'
         target_user_id = int(data.split('_')[1])
         
-        cur.execute(f"SELECT id FROM {schema}.users WHERE telegram_id = %s", (telegram_id,))
+        execute_prepared(cur, 'user_id_by_telegram_id', (telegram_id,))
         from_user = cur.fetchone()
         
         if from_user:
             # Сохраняем реакцию
-            cur.execute(f"""
-                INSERT INTO {schema}.user_reactions (from_user_id, to_user_id, reaction_type)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (from_user_id, to_user_id) DO UPDATE SET reaction_type = %s
-            """, (from_user['id'], target_user_id, reaction_type, reaction_type))
+            execute_prepared(cur, 'reaction_upsert', (from_user['id'], target_user_id, reaction_type))
+            if from_user['status'] == 'dormant':
+                # Свайп по кнопкам старой анкеты возвращает скрытую анкету в активный пул, как и поиск
+                cur.execute(f"UPDATE {SCHEMA}.users SET status = 'active', updated_at = CURRENT_TIMESTAMP WHERE id = %s", (from_user['id'],))
+                defer_message(chat_id, "✅ Анкета снова видна другим.")
             conn.commit()
             
             if reaction_type == 'like':
                 # Проверяем взаимную симпатию
-                cur.execute(f"""
-                    SELECT * FROM {schema}.user_reactions 
-                    WHERE from_user_id = %s AND to_user_id = %s AND reaction_type = 'like'
-                """, (target_user_id, from_user['id']))
+                execute_prepared(cur, 'mutual_like', (target_user_id, from_user['id']))
                 mutual_like = cur.fetchone()
                 
                 if mutual_like:
                     # Создаем матч
                     cur.execute(f"""
-                        INSERT INTO {schema}.matches (user1_id, user2_id, status, matched_at)
+                        INSERT INTO {SCHEMA}.matches (user1_id, user2_id, status, matched_at)
                         VALUES (%s, %s, 'active', CURRENT_TIMESTAMP)
                     """, (from_user['id'], target_user_id))
                     conn.commit()
                     
                     # Уведомляем обоих
-                    cur.execute(f"SELECT * FROM {schema}.users WHERE id = %s", (target_user_id,))
+                    cur.execute(f"SELECT * FROM {SCHEMA}.users WHERE id = %s", (target_user_id,))
                     target_user = cur.fetchone()
                     
                     send_message(chat_id, f"💘 <b>Взаимная симпатия!</b>\n\nВы понравились друг другу! Можете начать общение.")
                     send_message(target_user['telegram_id'], f"💘 <b>Взаимная симпатия!</b>\n\nВы понравились друг другу! Можете начать общение.")
                 else:
-                    send_message(chat_id, "👍 Лайк отправлен! Если будет взаимность — мы сообщим.")
+                    answer_callback_query(callback_query.get('id'), "👍 Лайк отправлен! Если будет взаимность — мы сообщим.")
             else:
-                send_message(chat_id, "👎 Понятно, ищем дальше...")
+                answer_callback_query(callback_query.get('id'), "👎 Понятно, ищем дальше...")
             
-            # Показываем следующую анкету
-            show_next_profile(chat_id, telegram_id)
+            # Показываем следующую анкету (на том же соединении)
+            show_next_profile(chat_id, telegram_id, cur)
     
     elif data.startswith('delete_profile'):
         # Удаление анкеты
-        cur.execute(f"DELETE FROM {schema}.users WHERE telegram_id = %s", (telegram_id,))
+        cur.execute(f"DELETE FROM {SCHEMA}.users WHERE telegram_id = %s RETURNING id", (telegram_id,))
+        deleted = cur.fetchone()
         conn.commit()
+        if deleted:
+            invalidate_profile_card(deleted['id'])
         send_message(chat_id, "🗑 Анкета удалена. Используй /start для создания новой.")
     
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
 
-def show_next_profile(chat_id: int, telegram_id: int):
-    """Показать следующую анкету для оценки"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+def show_next_profile(chat_id: int, telegram_id: int, cur):
+    """Показать следующую анкету для оценки (cur — курсор обработчика на основной базе)"""
+    # Второе соединение из пула не берем: пул держит одно простаивающее соединение,
+    # лишние закрываются при возврате вместе с подготовленными на них запросами
     
     # Получаем текущего пользователя
-    cur.execute(f"SELECT * FROM {schema}.users WHERE telegram_id = %s", (telegram_id,))
+    execute_prepared(cur, 'user_by_telegram_id', (telegram_id,))
     current_user = cur.fetchone()
     
     if not current_user:
-        cur.close()
-        conn.close()
         return
     
     # Ищем анкеты, которые пользователь еще не оценил
-    cur.execute(f"""
-        SELECT u.* FROM {schema}.users u
-        WHERE u.id != %s 
-        AND u.status = 'active'
-        AND NOT EXISTS (
-            SELECT 1 FROM {schema}.user_reactions r 
-            WHERE r.from_user_id = %s AND r.to_user_id = u.id
-        )
-        ORDER BY RANDOM()
-        LIMIT 1
-    """, (current_user['id'], current_user['id']))
+    execute_prepared(cur, 'next_candidate', (current_user['id'], current_user['city_id']))
     
     next_user = cur.fetchone()
     
     if not next_user:
         send_message(chat_id, "😔 Пока нет новых анкет. Попробуй позже!")
-        cur.close()
-        conn.close()
         return
     
-    # Получаем медиа пользователя
-    cur.execute(f"""
-        SELECT * FROM {schema}.user_media 
-        WHERE user_id = %s 
-        ORDER BY media_type, position
-    """, (next_user['id'],))
-    media_files = cur.fetchall()
+    card = get_cached_profile_card(next_user['id'], next_user['updated_at'])
+    if card is None:
+        profile = load_profile_card(cur, next_user['id'])
+        
+        if not profile:
+            send_message(chat_id, "😔 Пока нет новых анкет. Попробуй позже!")
+            return
+        
+        card = render_profile_card(profile)
+        store_profile_card(next_user['id'], card)
     
-    # Формируем текст анкеты
-    profile_text = f"""👤 <b>{next_user['first_name']}, {next_user['age']}</b>
-📍 {next_user['city']}
+    # Отправляем медиа
+    if card['media']:
+        # Уведомления, не помещающиеся в подпись карточки, уходят до ее первого медиа, а не после
+        send_deferred_if_unfit(chat_id, card['caption'], CAPTION_LIMIT)
+        for index, (media_type, file_id) in enumerate(card['media']):
+            if media_type == 'photo':
+                if index == len(card['media']) - 1:  # Последнее фото — с текстом и кнопками
+                    send_photo(chat_id, file_id, card['caption'], card['keyboard'])
+                else:
+                    send_photo(chat_id, file_id)
+            elif media_type == 'video':
+                send_video(chat_id, file_id, card['caption'], card['keyboard'])
+    else:
+        send_message(chat_id, card['caption'], card['keyboard'])
+
 
-{next_user['bio']}"""
+def load_profile_card(cur, user_id: int):
+    """Данные карточки анкеты: с реплики, если она свежая, иначе через курсор обработчика"""
+    # Чужая анкета не зависит от только что записанной реакции — ее можно читать с реплики
+    return fetch_readonly('profile_card', (user_id,), cur)
+
+
+def render_profile_card(profile: dict) -> dict:
+    """Отрисовка карточки анкеты: подпись, file_id медиа и готовый JSON клавиатуры"""
+    caption = f"""👤 <b>{profile['first_name']}, {profile['age']}</b>
+📍 {profile['city']}
+
+{profile['bio']}"""
     
     keyboard = {
         'inline_keyboard': [[
-            {'text': '❌ Дизлайк', 'callback_data': f"dislike_{next_user['id']}"},
-            {'text': '💚 Лайк', 'callback_data': f"like_{next_user['id']}"}
+            {'text': '❌ Дизлайк', 'callback_data': f"dislike_{profile['id']}"},
+            {'text': '💚 Лайк', 'callback_data': f"like_{profile['id']}"}
         ]]
     }
     
-    # Отправляем медиа
-    if media_files:
-        for media in media_files:
-            if media['media_type'] == 'photo':
-                if media == media_files[-1]:  # Последнее фото — с текстом и кнопками
-                    send_photo(chat_id, media['file_id'], profile_text, keyboard)
-                else:
-                    send_photo(chat_id, media['file_id'])
-            elif media['media_type'] == 'video':
-                send_video(chat_id, media['file_id'], profile_text, keyboard)
-    else:
-        send_message(chat_id, profile_text, keyboard)
+    return {
+        'version': profile['updated_at'],
+        'caption': caption,
+        'media': [(media['media_type'], media['file_id']) for media in profile['media']],
+        'keyboard': json.dumps(keyboard)
+    }
+
+
+def get_cached_profile_card(user_id: int, version):
+    """Карточка из кэша, если ее версия совпадает с текущей версией анкеты"""
+    card = _profile_cards.get(user_id)
+    if card is None or card['version'] != version:
+        PROFILE_CACHE_STATS['misses'] += 1
+        return None
+    
+    _profile_cards.move_to_end(user_id)
+    PROFILE_CACHE_STATS['hits'] += 1
+    lookups = PROFILE_CACHE_STATS['hits'] + PROFILE_CACHE_STATS['misses']
+    if lookups % 1000 == 0:
+        print(
+            f"Profile cache: {PROFILE_CACHE_STATS['hits']} hits of {lookups} lookups, "
+            f"{len(_profile_cards)} cards, {PROFILE_CACHE_STATS['bytes']} bytes, "
+            f"{PROFILE_CACHE_STATS['evictions']} evictions"
+        )
+    return card
+
+
+def store_profile_card(user_id: int, card: dict):
+    """Сохранение карточки в кэш с вытеснением самых старых по лимиту памяти"""
+    invalidate_profile_card(user_id)
+    
+    card['size'] = (
+        sys.getsizeof(card['caption'])
+        + sys.getsizeof(card['keyboard'])
+        + sum(sys.getsizeof(file_id) for _, file_id in card['media'])
+        + 256  # словарь, кортежи и ключ
+    )
+    _profile_cards[user_id] = card
+    PROFILE_CACHE_STATS['bytes'] += card['size']
     
-    cur.close()
-    conn.close()
+    while PROFILE_CACHE_STATS['bytes'] > PROFILE_CACHE_MAX_BYTES and _profile_cards:
+        _, evicted = _profile_cards.popitem(last=False)
+        PROFILE_CACHE_STATS['bytes'] -= evicted['size']
+        PROFILE_CACHE_STATS['evictions'] += 1
+
+
+def invalidate_profile_card(user_id: int):
+    """Удаление карточки из кэша (анкета изменена, скрыта или удалена)"""
+    card = _profile_cards.pop(user_id, None)
+    if card is not None:
+        PROFILE_CACHE_STATS['bytes'] -= card['size']
 
 
 def handle_search(chat_id: int, user_data: dict) -> dict:
@@ -578,22 +1174,27 @@ def handle_search(chat_id: int, user_data: dict) -> dict:
     
     conn = get_db_connection()
     cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
-    cur.execute(f"SELECT * FROM {schema}.users WHERE telegram_id = %s AND status = 'active'", (telegram_id,))
+    cur.execute(f"SELECT * FROM {SCHEMA}.users WHERE telegram_id = %s AND status IN ('active', 'dormant')", (telegram_id,))
     user = cur.fetchone()
     
     if not user:
         send_message(chat_id, "❌ Сначала заполни анкету через /start")
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
     
-    send_message(chat_id, "🔍 Ищем анкеты...")
-    show_next_profile(chat_id, telegram_id)
+    if user['status'] == 'dormant':
+        # Анкета скрыта за неактивность: поиск возвращает ее в активный пул, как и /start
+        cur.execute(f"UPDATE {SCHEMA}.users SET status = 'active', updated_at = CURRENT_TIMESTAMP WHERE id = %s", (user['id'],))
+        conn.commit()
+        defer_message(chat_id, "✅ Анкета снова видна другим.")
+    
+    defer_message(chat_id, "🔍 Ищем анкеты...")
+    show_next_profile(chat_id, telegram_id, cur)
     
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
@@ -602,15 +1203,14 @@ def handle_profile(chat_id: int, user_data: dict) -> dict:
     """Показать профиль пользователя"""
     telegram_id = user_data.get('id')
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
-    
-    cur.execute(f"SELECT * FROM {schema}.users WHERE telegram_id = %s", (telegram_id,))
-    user = cur.fetchone()
+    user = fetch_readonly('user_by_telegram_id', (telegram_id,))
     
-    if user and user['status'] in ['active', 'paused']:
-        status_text = "✅ Активна" if user['status'] == 'active' else "⏸ Приостановлена"
+    if user and user['status'] in ['active', 'paused', 'dormant']:
+        status_text = {
+            'active': "✅ Активна",
+            'paused': "⏸ Приостановлена",
+            'dormant': "💤 Скрыта из-за неактивности (вернется после /start)"
+        }[user['status']]
         
         profile_text = f"""👤 <b>Твоя анкета</b>
 
@@ -631,9 +1231,6 @@ def handle_profile(chat_id: int, user_data: dict) -> dict:
     else:
         send_message(chat_id, "❌ Анкета не заполнена. Используй /start")
     
-    cur.close()
-    conn.close()
-    
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
 
@@ -643,15 +1240,21 @@ def handle_pause_profile(chat_id: int, user_data: dict) -> dict:
     
     conn = get_db_connection()
     cur = conn.cursor()
-    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
-    cur.execute(f"UPDATE {schema}.users SET status = 'paused' WHERE telegram_id = %s", (telegram_id,))
+    cur.execute(f"""
+        UPDATE {SCHEMA}.users SET status = 'paused', updated_at = CURRENT_TIMESTAMP
+        WHERE telegram_id = %s
+        RETURNING id
+    """, (telegram_id,))
+    paused = cur.fetchone()
     conn.commit()
+    if paused:
+        invalidate_profile_card(paused['id'])
     
     send_message(chat_id, "⏸ Поиск остановлен. Твоя анкета скрыта.\n\nИспользуй /start чтобы возобновить.")
     
     cur.close()
-    conn.close()
+    release_db_connection(conn)
     
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
 
@@ -666,3 +1269,39 @@ def handle_settings(chat_id: int, user_data: dict) -> dict:
     send_message(chat_id, "⚙️ <b>Настройки</b>\n\nВыбери действие:", keyboard)
     
     return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'ok': True}), 'isBase64Encoded': False}
+
+
+def serve_worker(port: int):
+    """Локальный процесс-воркер (или роутер): принимает обновления по HTTP и передает в handler()"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    
+    class WorkerRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            event = {
+                'httpMethod': 'POST',
+                'headers': dict(self.headers),
+                'body': self.rfile.read(length).decode()
+            }
+            result = handler(event, None)
+            
+            body = result['body'].encode()
+            headers = dict(result.get('headers') or {})
+            if SHARD_WORKER_ID:
+                headers.setdefault(SHARD_HANDLED_BY_HEADER, SHARD_WORKER_ID)
+            self.send_response(result['statusCode'])
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    # Однопоточный сервер: кэши и буферы модуля не рассчитаны на параллельные обновления
+    HTTPServer(('', port), WorkerRequestHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    serve_worker(int(os.environ.get('PORT', '8001')))
\ No newline at end of file
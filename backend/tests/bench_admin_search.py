@@ -0,0 +1,81 @@
+"""Бенчмарк поиска пользователей admin-api (action=search) на засеянной таблице.
+
+Засевает отдельную схему (по умолчанию 1M анкет), выполняет типичные запросы модераторов
+через search_users, печатает p50/p95, число совпавших анкет и план каждого запроса.
+Завершается с ошибкой, если p95 превышает бюджет или план читает users целиком (Seq Scan).
+Ранжируются только кандидаты (SEARCH_CANDIDATES на каждый индекс), поэтому время не зависит
+от числа совпадений.
+
+    TEST_DATABASE_URL=postgresql://... python backend/tests/bench_admin_search.py [--users N] [--no-seed]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import support
+
+# Запросы модераторов: имя, username, город, слово из описания, опечатка, несколько слов
+QUERIES = ['Анна', 'user123456', 'Новосибирск', 'сноуборд', 'Новосибрск', 'кофе горы', 'Дмитрий Омск']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--budget-ms', type=float, default=50.0, help='допустимый p95 одного поиска')
+    parser.add_argument('--schema', default='leomatch_search_bench')
+    parser.add_argument('--no-seed', action='store_true', help='использовать уже засеянную схему')
+    args = parser.parse_args()
+    
+    if not args.no_seed:
+        conn = support.connect(schema=args.schema)
+        started = time.perf_counter()
+        support.create_schema(conn, args.schema)
+        support.seed(conn, users=args.users, reactions_per_user=0)
+        conn.close()
+        print(f"Seeded {args.users} users in {time.perf_counter() - started:.0f} s\n")
+    
+    admin = support.load_function('admin-api')
+    log = []
+    conn = support.connect(schema=args.schema, cursor_factory=support.recording_cursor(log))
+    
+    failed = False
+    print(f"{'query':<16}{'ranked':>9}{'p50, ms':>10}{'p95, ms':>10}  plan")
+    for query in QUERIES:
+        samples = []
+        for _ in range(args.iterations + 3):
+            started = time.perf_counter()
+            admin.search_users(conn, query, 50)
+            samples.append((time.perf_counter() - started) * 1000)
+            conn.rollback()
+        samples = samples[3:]  # прогрев
+        p50 = statistics.median(samples)
+        p95 = statistics.quantiles(samples, n=20)[-1]
+        
+        cur = conn.cursor()
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {log[-1][1]}")
+        nodes = support.plan_nodes(cur.fetchone()['QUERY PLAN'][0]['Plan'])
+        conn.rollback()
+        cur.close()
+        
+        node_types = [node['Node Type'] for node in nodes]
+        ranked = next(node['Actual Rows'] for node in nodes if node['Node Type'] == 'Append')
+        seq_scans = [node.get('Relation Name') for node in nodes if node['Node Type'] == 'Seq Scan']
+        summary = ' > '.join(dict.fromkeys(node_types))
+        print(f"{query:<16}{ranked:>9.0f}{p50:>10.1f}{p95:>10.1f}  {summary}")
+        
+        if p95 > args.budget_ms:
+            print(f"  FAIL: p95 {p95:.1f} ms over the {args.budget_ms:.0f} ms budget")
+            failed = True
+        if seq_scans:
+            print(f"  FAIL: expected index scans, got seq scans on {json.dumps(seq_scans)}")
+            failed = True
+    
+    conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
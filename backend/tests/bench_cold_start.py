@@ -0,0 +1,109 @@
+"""Профиль холодного старта облачных функций: -X importtime и задержка первого запроса.
+
+Для каждой функции печатаются самые дорогие импорты index.py (по накопленному времени)
+и задержки холодного процесса: импорт, первый запрос без базы (OPTIONS), первый запрос
+с базой (ленивый импорт psycopg2 и подключение) и следующий, уже теплый, запрос.
+
+    python backend/tests/bench_cold_start.py [--runs N]
+    TEST_DATABASE_URL=postgresql://... python backend/tests/bench_cold_start.py   # с запросами к базе
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+import support
+
+# Запросы холодного процесса: без базы и с обращением к базе (без вызовов Bot API)
+REQUESTS = {
+    'telegram-bot': [
+        ('options', {'httpMethod': 'OPTIONS'}),
+        ('update', {'httpMethod': 'POST', 'body': json.dumps({'message': {'from': {'id': 1000000001}}})}),
+    ],
+    'admin-api': [
+        ('options', {'httpMethod': 'OPTIONS'}),
+        ('stats', {'httpMethod': 'GET', 'queryStringParameters': {'action': 'stats'}}),
+    ],
+}
+
+PROBE = """
+import json, sys, time
+timings = {}
+started = time.perf_counter()
+import index
+timings['import'] = time.perf_counter() - started
+for name, event in json.loads(sys.argv[1]):
+    if name != 'options' and not index.os.environ.get('DATABASE_URL'):
+        continue
+    started = time.perf_counter()
+    index.handler(event, None)
+    timings[name] = time.perf_counter() - started
+    if name != 'options':
+        started = time.perf_counter()
+        index.handler(event, None)
+        timings[name + ' (warm)'] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+
+def import_profile(function: str, top: int) -> list:
+    """Самые дорогие импорты по отчету -X importtime: (накопленное время в мкс, модуль)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import index'],
+        cwd=support.BACKEND_DIR / function,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)', line)
+        if match:
+            entries.append((int(match.group(2)), match.group(3)[1:] + match.group(4)))
+    return sorted(entries, reverse=True)[:top]
+
+
+def first_requests(function: str, env: dict) -> dict:
+    """Задержки холодного процесса: импорт и первые запросы, секунды"""
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, json.dumps(REQUESTS[function])],
+        cwd=support.BACKEND_DIR / function,
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='холодных процессов на функцию')
+    parser.add_argument('--top', type=int, default=10, help='строк отчета -X importtime')
+    args = parser.parse_args()
+    
+    env = dict(os.environ)
+    env.pop('DATABASE_URL', None)
+    if support.TEST_DATABASE_URL:
+        # Бот обращается к таблицам через MAIN_DB_SCHEMA, admin-api — через search_path
+        env['DATABASE_URL'] = support.schema_dsn(support.TEST_DATABASE_URL)
+        env['MAIN_DB_SCHEMA'] = support.TEST_DB_SCHEMA
+    
+    for function in REQUESTS:
+        print(f"== {function}")
+        print("-X importtime, cumulative:")
+        for cumulative_us, module in import_profile(function, args.top):
+            print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+        
+        runs = [first_requests(function, env) for _ in range(args.runs)]
+        print(f"cold process, median of {args.runs}:")
+        for name in runs[0]:
+            print(f"  {name:<16}{statistics.median(run[name] for run in runs) * 1000:8.1f} ms")
+        print()
+
+
+if __name__ == '__main__':
+    main()
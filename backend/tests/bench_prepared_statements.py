@@ -0,0 +1,94 @@
+"""Бенчмарк подготовленных запросов бота: сколько разбора и планирования экономит PREPARE.
+
+Для каждого читающего запроса из STATEMENTS сравнивается прежний путь (текст запроса
+с параметрами на каждый вызов) и EXECUTE подготовленного запроса на том же соединении:
+время на клиенте и Planning Time, который сообщает сервер (EXPLAIN ANALYZE).
+
+    TEST_DATABASE_URL=postgresql://... python backend/tests/bench_prepared_statements.py [--users N] [--no-seed]
+"""
+import argparse
+import os
+import statistics
+import time
+
+import support
+
+# Запросы одного свайпа: лайк/дизлайк и показ следующей анкеты
+SWIPE_STATEMENTS = ['user_id_by_telegram_id', 'mutual_like', 'user_by_telegram_id', 'next_candidate', 'profile_card']
+
+
+def timed(run, iterations: int) -> float:
+    """Медиана времени одного вызова в микросекундах"""
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def planning_time(cur, query: str, params) -> float:
+    """Planning Time запроса по данным сервера, мс"""
+    cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params)
+    return cur.fetchone()['QUERY PLAN'][0]['Planning Time']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--no-seed', action='store_true', help='использовать уже засеянную схему')
+    args = parser.parse_args()
+    
+    conn = support.connect()
+    if not args.no_seed:
+        support.create_schema(conn)
+        support.seed(conn, users=args.users)
+    
+    os.environ['MAIN_DB_SCHEMA'] = support.TEST_DB_SCHEMA
+    bot = support.load_function('telegram-bot')
+    conn.close()
+    
+    conn = support.connect(connection_factory=bot.get_connection_class())
+    params = support.bot_statement_params(support.sample_user(conn))
+    cur = conn.cursor()
+    
+    print(f"{'statement':<24}{'plain, us':>12}{'prepared, us':>14}{'saved, us':>11}{'plan, ms':>10}{'plan prep., ms':>16}")
+    saved_per_swipe = 0.0
+    for name in SWIPE_STATEMENTS:
+        plain_query = support.inline_params(bot.STATEMENTS[name])
+        plain_params = support.as_named(params[name])
+        
+        def run_plain():
+            cur.execute(plain_query, plain_params)
+            cur.fetchall()
+        
+        def run_prepared():
+            bot.execute_prepared(cur, name, params[name])
+            cur.fetchall()
+        
+        # Прогрев: кэши страниц и переход подготовленного запроса на общий план (после 5 вызовов)
+        for _ in range(10):
+            run_plain()
+            run_prepared()
+        
+        plain_us = timed(run_plain, args.iterations)
+        prepared_us = timed(run_prepared, args.iterations)
+        placeholders = ', '.join(['%s'] * len(params[name]))
+        plain_plan = planning_time(cur, plain_query, plain_params)
+        prepared_plan = planning_time(cur, f"EXECUTE {name} ({placeholders})", params[name])
+        conn.rollback()
+        
+        saved_per_swipe += plain_us - prepared_us
+        print(
+            f"{name:<24}{plain_us:>12.0f}{prepared_us:>14.0f}{plain_us - prepared_us:>11.0f}"
+            f"{plain_plan:>10.3f}{prepared_plan:>16.3f}"
+        )
+    
+    print(f"\nSaved per swipe update ({len(SWIPE_STATEMENTS)} statements): {saved_per_swipe:.0f} us")
+    cur.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""Общие помощники тестов и бенчмарков облачных функций LeoMatch.
+
+Тесты с базой запускаются на отдельной схеме (TEST_DB_SCHEMA) в TEST_DATABASE_URL:
+схема создается заново, на нее накатываются миграции из db_migrations и сид данных.
+"""
+import importlib.util
+import os
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+MIGRATIONS_DIR = BACKEND_DIR.parent / 'db_migrations'
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+TEST_DB_SCHEMA = os.environ.get('TEST_DB_SCHEMA', 'leomatch_test')
+
+# Слова для имен и описаний анкет сида
+FIRST_NAMES = [
+    'Анна', 'Мария', 'Елена', 'Ольга', 'Дарья', 'Алиса', 'Полина', 'Ксения', 'Софья', 'Виктория',
+    'Иван', 'Алексей', 'Дмитрий', 'Сергей', 'Максим', 'Артем', 'Никита', 'Егор', 'Павел', 'Кирилл'
+]
+BIO_WORDS = [
+    'люблю', 'путешествия', 'кино', 'книги', 'спорт', 'музыка', 'кофе', 'горы', 'море', 'йога',
+    'программист', 'дизайнер', 'врач', 'учитель', 'фотограф', 'танцы', 'бег', 'кулинария', 'театр', 'собаки',
+    'кошки', 'велосипед', 'сноуборд', 'гитара', 'живопись', 'настолки', 'походы', 'языки', 'наука', 'джаз'
+]
+
+
+def load_function(name: str, module_name: str = None):
+    """Загрузка index.py облачной функции (backend/<name>) как отдельного модуля"""
+    path = BACKEND_DIR / name / 'index.py'
+    spec = importlib.util.spec_from_file_location(module_name or name.replace('-', '_') + '_index', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def schema_dsn(dsn: str, schema: str = TEST_DB_SCHEMA) -> str:
+    """DSN, в котором search_path указывает на тестовую схему (нужно для запросов admin-api)"""
+    options = quote(f"-c search_path={schema},public")
+    separator = '&' if '?' in dsn else '?'
+    return f"{dsn}{separator}options={options}"
+
+
+def connect(dsn: str = None, schema: str = TEST_DB_SCHEMA, **kwargs):
+    """Подключение к тестовой базе с search_path на тестовую схему"""
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    
+    kwargs.setdefault('cursor_factory', RealDictCursor)
+    return psycopg2.connect(schema_dsn(dsn or TEST_DATABASE_URL, schema), **kwargs)
+
+
+def recording_cursor(log: list):
+    """Класс курсора, который дописывает в log пары (текст запроса, запрос с подставленными параметрами)"""
+    from psycopg2.extras import RealDictCursor
+    
+    class RecordingCursor(RealDictCursor):
+        def execute(self, query, vars=None):
+            log.append((query, self.mogrify(query, vars).decode()))
+            return super().execute(query, vars)
+    
+    return RecordingCursor
+
+
+def plan_nodes(plan: dict) -> list:
+    """Все узлы плана EXPLAIN (FORMAT JSON) в порядке обхода"""
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def create_schema(conn, schema: str = TEST_DB_SCHEMA):
+    """Пересоздание тестовой схемы и накат всех миграций по порядку версий"""
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path = {schema}, public")
+    
+    migrations = sorted(
+        MIGRATIONS_DIR.glob('V*__*.sql'),
+        key=lambda path: int(re.match(r'V(\d+)__', path.name).group(1))
+    )
+    for migration in migrations:
+        cur.execute(migration.read_text())
+    conn.commit()
+    cur.close()
+
+
+def seed(conn, users: int = 100000, reactions_per_user: int = 10):
+    """Сид данных в пропорциях продакшена: анкеты, медиа, реакции, матчи, сообщения"""
+    cur = conn.cursor()
+    
+    # Справочник городов: 16 крупных из миграции и длинный хвост небольших
+    cur.execute("""
+        INSERT INTO cities (name)
+        SELECT 'Город ' || g FROM generate_series(1, 2000) g
+        ON CONFLICT (name) DO NOTHING
+    """)
+    cur.execute("""
+        INSERT INTO city_aliases (alias, city_id)
+        SELECT normalize_city(name), id FROM cities
+        ON CONFLICT (alias) DO NOTHING
+    """)
+    
+    # Анкеты: 40% в крупных городах, статусы в пропорциях живой базы
+    cur.execute("""
+        WITH big AS (SELECT array_agg(id ORDER BY id) AS ids FROM cities WHERE name NOT LIKE 'Город %%'),
+        small AS (SELECT array_agg(id ORDER BY id) AS ids FROM cities WHERE name LIKE 'Город %%')
+        INSERT INTO users (
+            telegram_id, username, first_name, age, gender, city, city_id, bio,
+            status, verified, created_at, updated_at, last_seen_at
+        )
+        SELECT 1000000000 + g,
+               'user' || g,
+               (%(names)s::text[])[1 + g %% array_length(%(names)s::text[], 1)],
+               18 + g %% 50,
+               CASE WHEN g %% 2 = 0 THEN 'male' ELSE 'female' END,
+               c.name,
+               c.id,
+               array_to_string(ARRAY(
+                   SELECT (%(words)s::text[])[1 + (g * k * 7 + k) %% array_length(%(words)s::text[], 1)]
+                   FROM generate_series(1, 8) k
+               ), ' '),
+               CASE
+                   WHEN g %% 100 < 85 THEN 'active'
+                   WHEN g %% 100 < 90 THEN 'paused'
+                   WHEN g %% 100 < 95 THEN 'pending'
+                   WHEN g %% 100 < 98 THEN 'dormant'
+                   ELSE 'banned'
+               END,
+               g %% 10 != 0,
+               now() - make_interval(days => g %% 365, secs => g %% 86400),
+               now() - make_interval(days => g %% 90),
+               now() - make_interval(days => g %% 60)
+        FROM generate_series(1, %(users)s) g
+        CROSS JOIN big
+        CROSS JOIN small
+        JOIN cities c ON c.id = CASE
+            WHEN g %% 10 < 4 THEN big.ids[1 + g %% array_length(big.ids, 1)]
+            ELSE small.ids[1 + g %% array_length(small.ids, 1)]
+        END
+    """, {'names': FIRST_NAMES, 'words': BIO_WORDS, 'users': users})
+    
+    # Две фотографии у каждой анкеты и видео у каждой пятой
+    cur.execute("""
+        INSERT INTO user_media (user_id, media_type, file_id, position)
+        SELECT u.id, 'photo', 'photo_' || u.id || '_' || p, p
+        FROM users u, generate_series(0, 1) p
+    """)
+    cur.execute("""
+        INSERT INTO user_media (user_id, media_type, file_id, position)
+        SELECT id, 'video', 'video_' || id, 0 FROM users WHERE id % 5 = 0
+    """)
+    
+    # Реакции: каждая анкета оценила несколько других, примерно треть — лайки
+    cur.execute("""
+        INSERT INTO user_reactions (from_user_id, to_user_id, reaction_type, created_at)
+        SELECT u.id, 1 + (u.id * 7919 + k * 104729) %% %(users)s,
+               CASE WHEN (u.id + k) %% 3 = 0 THEN 'like' ELSE 'dislike' END,
+               now() - make_interval(hours => (u.id + k) %% 720)
+        FROM users u, generate_series(1, %(reactions)s) k
+        WHERE 1 + (u.id * 7919 + k * 104729) %% %(users)s != u.id
+        ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+    """, {'users': users, 'reactions': reactions_per_user})
+    
+    # Матчи у каждой десятой анкеты и переписка в них
+    cur.execute("""
+        INSERT INTO matches (user1_id, user2_id, status, created_at, matched_at)
+        SELECT g, g + 1, CASE WHEN g %% 7 = 0 THEN 'closed' ELSE 'active' END,
+               now() - make_interval(hours => g %% 2000), now() - make_interval(hours => g %% 2000)
+        FROM generate_series(1, %(users)s - 1, 10) g
+    """, {'users': users})
+    cur.execute("""
+        INSERT INTO messages (match_id, sender_id, message_text, created_at)
+        SELECT m.id, CASE WHEN k % 2 = 0 THEN m.user1_id ELSE m.user2_id END,
+               'Привет! Сообщение ' || k, m.created_at + make_interval(mins => k)
+        FROM matches m, generate_series(1, 5) k
+    """)
+    
+    # Незавершенные регистрации и bucket'ы антифлуда
+    cur.execute("""
+        INSERT INTO user_registration_state (telegram_id, current_step, temp_data)
+        SELECT telegram_id, 'city', jsonb_build_object('age', age, 'gender', gender)
+        FROM users WHERE status = 'pending'
+    """)
+    cur.execute("""
+        INSERT INTO flood_buckets (telegram_id, tokens, allowed, updated_at)
+        SELECT telegram_id, 4, TRUE, now() - make_interval(secs => id % 7200) FROM users
+    """)
+    conn.commit()
+    
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE")
+    conn.autocommit = False
+    cur.close()
+
+
+def sample_user(conn) -> dict:
+    """Активная анкета сида с реакциями — источник параметров горячих запросов"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT u.id, u.telegram_id, u.city_id, r.to_user_id AS target_id
+        FROM users u
+        JOIN user_reactions r ON r.from_user_id = u.id
+        WHERE u.status = 'active'
+        ORDER BY u.id
+        LIMIT 1
+    """)
+    user = cur.fetchone()
+    conn.rollback()
+    cur.close()
+    return dict(user)
+
+
+def bot_statement_params(user: dict) -> dict:
+    """Параметры для каждого запроса из STATEMENTS бота"""
+    return {
+        'user_by_telegram_id': (user['telegram_id'],),
+        'user_id_by_telegram_id': (user['telegram_id'],),
+        'reaction_upsert': (user['id'], user['target_id'], 'like'),
+        'mutual_like': (user['target_id'], user['id']),
+        'next_candidate': (user['id'], user['city_id']),
+        'profile_card': (user['target_id'],),
+        'registration_step': (user['telegram_id'], 'Москва', None, 'female'),
+        'media_upload': (user['telegram_id'], 'photo', 'photo_file_id'),
+        'finish_registration': (user['telegram_id'],),
+        'touch_last_seen': (user['telegram_id'], 300.0),
+        'flood_take_token': (user['telegram_id'], 5.0, 1.0),
+    }
+
+
+def inline_params(statement: str) -> str:
+    """Запрос из STATEMENTS с плейсхолдерами $n в формате psycopg2 (%(pn)s)"""
+    return re.sub(r'\$(\d+)', r'%(p\1)s', statement.replace('%', '%%'))
+
+
+def as_named(params: tuple) -> dict:
+    """Позиционные параметры для запроса после inline_params"""
+    return {f"p{index}": value for index, value in enumerate(params, start=1)}
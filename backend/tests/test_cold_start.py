@@ -0,0 +1,47 @@
+"""Регрессия холодного старта: импорт index.py укладывается в бюджет и не тянет тяжелые модули."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from support import BACKEND_DIR
+
+# Бюджет импорта index.py в холодном процессе, секунды
+IMPORT_BUDGET = float(os.environ.get('COLD_START_IMPORT_BUDGET', '0.15'))
+
+# Модули, которые должны загружаться только при первом обращении к базе или Bot API
+HEAVY_MODULES = ['psycopg2', 'urllib3', 'requests']
+
+PROBE = f"""
+import json, sys, time
+started = time.perf_counter()
+import index
+elapsed = time.perf_counter() - started
+print(json.dumps({{'elapsed': elapsed, 'heavy': [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+def cold_import(function: str) -> dict:
+    """Импорт index.py функции в новом интерпретаторе"""
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE],
+        cwd=BACKEND_DIR / function,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize('function', ['telegram-bot', 'admin-api'])
+def test_cold_import_skips_heavy_modules(function):
+    assert cold_import(function)['heavy'] == []
+
+
+@pytest.mark.parametrize('function', ['telegram-bot', 'admin-api'])
+def test_cold_import_within_budget(function):
+    # Лучший из трех запусков: шум планировщика не должен ронять тест
+    elapsed = min(cold_import(function)['elapsed'] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, f"cold import of {function} took {elapsed * 1000:.1f} ms"
@@ -0,0 +1,37 @@
+"""Дайджест лайков: водяной знак сдвигается только получателям, которым дайджест доставлен."""
+import pytest
+
+from support import load_function
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('urllib3')
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.data = b'{}'
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    module = load_function('bot-jobs')
+    monkeypatch.setattr(module, 'DIGEST_RATE', 1e6)
+    return module
+
+
+def test_batch_outcome_by_status(monkeypatch, jobs):
+    statuses = {101: 200, 102: 500, 103: 403, 104: 400}
+    monkeypatch.setattr(jobs, 'telegram_api', lambda method, payload: FakeResponse(statuses[payload['chat_id']]))
+    recipients = [{'id': telegram_id - 100, 'telegram_id': telegram_id, 'likes': 1} for telegram_id in statuses]
+    
+    assert jobs.send_digest_batch(recipients) == {'sent': [1], 'undeliverable': [3, 4], 'failed': [2]}
+
+
+def test_network_error_is_retried_later(monkeypatch, jobs):
+    def unreachable(method, payload):
+        raise jobs.urllib3.exceptions.ConnectTimeoutError('timeout')
+    
+    monkeypatch.setattr(jobs, 'telegram_api', unreachable)
+    
+    assert jobs.send_digest({'id': 1, 'telegram_id': 101, 'likes': 2}) == 'failed'
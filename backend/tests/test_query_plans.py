@@ -0,0 +1,145 @@
+"""EXPLAIN-регрессия горячих запросов обоих index.py: без Seq Scan и без Sort поверх выборки.
+
+Запускается на засеянной схеме TEST_DB_SCHEMA в TEST_DATABASE_URL, без нее пропускается:
+
+    TEST_DATABASE_URL=postgresql://... [TEST_SEED_USERS=100000] python -m pytest backend/tests/test_query_plans.py
+"""
+import json
+import os
+
+import pytest
+
+import support
+
+pytestmark = pytest.mark.skipif(not support.TEST_DATABASE_URL, reason='TEST_DATABASE_URL is not set')
+
+SEED_USERS = int(os.environ.get('TEST_SEED_USERS', '100000'))
+
+# Все запросы STATEMENTS бота (полноту проверяет test_every_bot_statement_is_covered)
+BOT_STATEMENTS = [
+    'user_by_telegram_id', 'user_id_by_telegram_id', 'reaction_upsert', 'mutual_like', 'next_candidate',
+    'profile_card', 'registration_step', 'media_upload', 'finish_registration', 'touch_last_seen',
+    'flood_take_token',
+]
+
+# Запросы admin-api по действиям: (id теста, метод, параметры, тело)
+ADMIN_REQUESTS = [
+    ('stats', 'GET', {'action': 'stats'}, None),
+    ('users-all', 'GET', {'action': 'users'}, None),
+    ('users-pending', 'GET', {'action': 'users', 'status': 'pending'}, None),
+    ('search', 'GET', {'action': 'search', 'q': 'Анна'}, None),
+    ('search-next-page', 'GET', {'action': 'search', 'q': 'Анна', 'after_score': '0.5', 'after_id': '1000'}, None),
+    ('matches', 'GET', {'action': 'matches'}, None),
+    ('messages', 'GET', {'action': 'messages'}, None),
+    ('messages-by-match', 'GET', {'action': 'messages', 'match_id': '11'}, None),
+    ('moderate', 'POST', {'action': 'moderate'}, {'user_id': 5, 'action': 'approve'}),
+    ('bulk-moderate', 'POST', {'action': 'bulk_moderate'}, {'items': [
+        {'user_id': 6, 'action': 'approve'}, {'user_id': 7, 'action': 'reject'},
+    ]}),
+    ('update-user', 'PUT', {'action': 'update_user'}, {'user_id': 8, 'status': 'active'}),
+]
+
+
+def normalize(query: str) -> str:
+    """Текст запроса без лишних пробелов и переводов строк"""
+    return ' '.join(query.split())
+
+
+# Узлы, которые запрос не может обойти: (текст запроса, тип узла) -> причина.
+# Запрос сравнивается целиком, с точностью до пробелов: похожие запросы не проходят молча
+ALLOWED = {
+    (normalize('SELECT COUNT(*) as total FROM users'), 'Seq Scan'):
+        'общее число анкет: Index Only Scan не дешевле полного прохода',
+    (normalize(support.load_function('admin-api').USER_SEARCH_QUERY), 'Sort'):
+        'поиск ранжирует кандидатов (не больше SEARCH_CANDIDATES на индекс) по вычисляемому score',
+}
+
+# Sort не считается регрессией над свернутыми группами (Aggregate) и над выборкой по индексу
+# из нескольких строк (сообщения одного матча): порядок таких входов индекс не ускорит
+SMALL_SORT_ROWS = 100
+
+
+def plan_problems(query: str, plan: dict) -> list:
+    """Узлы Seq Scan и Sort в плане запроса, кроме разрешенных в ALLOWED"""
+    problems = []
+    for node in support.plan_nodes(plan):
+        if node['Node Type'] not in ('Seq Scan', 'Sort'):
+            continue
+        if node['Node Type'] == 'Sort':
+            child = node['Plans'][0]
+            if child['Node Type'] == 'Aggregate' or child['Plan Rows'] <= SMALL_SORT_ROWS:
+                continue
+        if (normalize(query), node['Node Type']) in ALLOWED:
+            continue
+        problems.append(f"{node['Node Type']} {node.get('Relation Name') or node.get('Sort Key')}")
+    return problems
+
+
+@pytest.fixture(scope='module')
+def seeded_user():
+    pytest.importorskip('psycopg2')
+    conn = support.connect()
+    support.create_schema(conn)
+    support.seed(conn, users=SEED_USERS)
+    user = support.sample_user(conn)
+    conn.close()
+    return user
+
+
+@pytest.fixture(scope='module')
+def bot(seeded_user):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('MAIN_DB_SCHEMA', support.TEST_DB_SCHEMA)
+        return support.load_function('telegram-bot', 'telegram_bot_plans')
+
+
+@pytest.fixture
+def conn(seeded_user):
+    conn = support.connect()
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def test_every_bot_statement_is_covered(bot):
+    assert sorted(BOT_STATEMENTS) == sorted(bot.STATEMENTS)
+
+
+@pytest.mark.parametrize('plan_cache_mode', ['force_custom_plan', 'force_generic_plan'])
+@pytest.mark.parametrize('name', BOT_STATEMENTS)
+def test_bot_statement_plan(bot, conn, seeded_user, name, plan_cache_mode):
+    params = support.bot_statement_params(seeded_user)[name]
+    cur = conn.cursor()
+    cur.execute(f"SET plan_cache_mode = {plan_cache_mode}")
+    cur.execute(f"PREPARE {name} AS {bot.STATEMENTS[name]}")
+    placeholders = ', '.join(['%s'] * len(params))
+    cur.execute(f"EXPLAIN (FORMAT JSON) EXECUTE {name} ({placeholders})", params)
+    plan = cur.fetchone()['QUERY PLAN'][0]['Plan']
+    
+    assert plan_problems(bot.STATEMENTS[name], plan) == []
+
+
+@pytest.mark.parametrize('method, params, body', [request[1:] for request in ADMIN_REQUESTS],
+                         ids=[request[0] for request in ADMIN_REQUESTS])
+def test_admin_action_plans(monkeypatch, conn, method, params, body):
+    admin = support.load_function('admin-api')
+    log = []
+    monkeypatch.setattr(admin, 'get_db_connection', lambda readonly=False: support.connect(
+        cursor_factory=support.recording_cursor(log)
+    ))
+    
+    event = {'httpMethod': method, 'queryStringParameters': params}
+    if body is not None:
+        event['body'] = json.dumps(body)
+    assert admin.handler(event, None)['statusCode'] == 200
+    assert log
+    
+    cur = conn.cursor()
+    problems = {}
+    for query, executed in log:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {executed}")
+        found = plan_problems(query, cur.fetchone()['QUERY PLAN'][0]['Plan'])
+        if found:
+            problems[normalize(query)[:120]] = found
+    
+    assert problems == {}
@@ -0,0 +1,64 @@
+"""Сбой реплики между проверками свежести: чтение уходит на основную базу, запрос не падает."""
+import pytest
+
+from support import load_function
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.connection = conn
+    
+    def execute(self, query, params=None):
+        if self.connection.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.connection.executed.append(query.split()[0])
+    
+    def fetchone(self):
+        return self.connection.row
+    
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, row=None, broken=False):
+        self.row = row
+        self.broken = broken
+        self.prepared = set()
+        self.executed = []
+    
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    module = load_function('telegram-bot', 'telegram_bot_replica')
+    monkeypatch.setattr(module, 'telegram_api', lambda method, payload: None)
+    monkeypatch.setattr(module, 'release_db_connection', lambda conn: None)
+    monkeypatch.setenv('DATABASE_REPLICA_URL', 'postgresql://replica')
+    monkeypatch.setattr(module, '_replica_state', {'fresh': True, 'checked_at': module.time.monotonic()})
+    return module
+
+
+def test_profile_card_falls_back_to_handler_cursor(monkeypatch, bot):
+    replica = FakeConnection(broken=True)
+    monkeypatch.setattr(bot, 'get_db_connection', lambda readonly=False: replica if readonly else pytest.fail('new primary connection'))
+    primary = FakeConnection(row={'id': 5})
+    
+    assert bot.load_profile_card(primary.cursor(), 5) == {'id': 5}
+    assert primary.executed == ['PREPARE', 'EXECUTE']
+    assert bot._replica_state['fresh'] is False
+
+
+def test_own_profile_falls_back_to_primary_connection(monkeypatch, bot):
+    connections = {True: FakeConnection(broken=True), False: FakeConnection(row={'id': 5, 'status': 'banned'})}
+    monkeypatch.setattr(bot, 'get_db_connection', lambda readonly=False: connections[readonly])
+    
+    result = bot.handle_profile(100, {'id': 100})
+    
+    assert result['statusCode'] == 200
+    assert connections[False].executed == ['PREPARE', 'EXECUTE']
+    assert bot._replica_state['fresh'] is False
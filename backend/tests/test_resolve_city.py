@@ -0,0 +1,43 @@
+"""Справочник городов: resolve_city не путает похожие города и не пополняется произвольным текстом."""
+import pytest
+
+import support
+
+pytestmark = pytest.mark.skipif(not support.TEST_DATABASE_URL, reason='TEST_DATABASE_URL is not set')
+
+CITIES_SCHEMA = f"{support.TEST_DB_SCHEMA}_cities"
+
+
+@pytest.fixture(scope='module')
+def conn():
+    pytest.importorskip('psycopg2')
+    conn = support.connect(schema=CITIES_SCHEMA)
+    support.create_schema(conn, CITIES_SCHEMA)
+    yield conn
+    conn.close()
+
+
+def resolve(conn, raw: str):
+    cur = conn.cursor()
+    cur.execute("SELECT (resolve_city(%s)).name AS name", (raw,))
+    name = cur.fetchone()['name']
+    cur.execute("SELECT a.alias, c.name FROM city_aliases a JOIN cities c ON c.id = a.city_id WHERE a.alias = normalize_city(%s)", (raw,))
+    alias = cur.fetchone()
+    conn.rollback()
+    return name, alias and alias['name']
+
+
+@pytest.mark.parametrize('raw, city, alias', [
+    ('г. Москва', 'Москва', 'Москва'),
+    ('Нижни Новгород', 'Нижний Новгород', 'Нижний Новгород'),
+    ('Новосибрск', 'Новосибирск', None),
+    ('Новгород', 'Новгород', 'Новгород'),
+    ('Пушкино', 'Пушкино', 'Пушкино'),
+])
+def test_city_is_resolved(conn, raw, city, alias):
+    assert resolve(conn, raw) == (city, alias)
+
+
+@pytest.mark.parametrize('raw', ['не скажу', '🙂 Москва 🙂', 'Москва, центр', 'а' * 300, '   '])
+def test_free_text_is_not_a_city(conn, raw):
+    assert resolve(conn, raw) == (None, None)
@@ -0,0 +1,110 @@
+"""Число обращений к базе на шаг регистрации и загрузку медиа: каждый переход — один запрос."""
+import pytest
+
+from support import load_function
+
+
+class FakeCursor:
+    """Курсор, который записывает запросы и отдает заготовленную строку для EXECUTE <имя>"""
+    
+    def __init__(self, conn):
+        self.connection = conn
+        self.row = None
+    
+    def execute(self, query, params=None):
+        command, name = query.split()[:2]
+        self.connection.executed.append(f"{command} {name}")
+        self.row = self.connection.rows.get(name) if command == 'EXECUTE' else None
+    
+    def fetchone(self):
+        return self.row
+    
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows: dict, prepared=()):
+        self.rows = rows
+        self.prepared = set(prepared)
+        self.executed = []
+        self.commits = 0
+    
+    def cursor(self):
+        return FakeCursor(self)
+    
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    module = load_function('telegram-bot')
+    monkeypatch.setattr(module, 'telegram_api', lambda method, payload: None)
+    monkeypatch.setattr(module, 'release_db_connection', lambda conn: None)
+    return module
+
+
+def use_connection(monkeypatch, bot, rows: dict, warm: bool = True) -> FakeConnection:
+    conn = FakeConnection(rows, bot.STATEMENTS if warm else ())
+    monkeypatch.setattr(bot, 'get_db_connection', lambda readonly=False: conn)
+    return conn
+
+
+@pytest.mark.parametrize('step, next_step, text', [
+    ('age', 'gender', '25'),
+    ('age', None, 'abc'),
+    ('gender', 'city', '👩 Женский'),
+    ('city', 'bio', 'Москва'),
+    ('bio', 'photo', 'Люблю горы'),
+    ('photo', None, 'текст вместо фото'),
+])
+def test_registration_step_is_one_round_trip(monkeypatch, bot, step, next_step, text):
+    conn = use_connection(monkeypatch, bot, {'registration_step': {'step': step, 'next_step': next_step}})
+    
+    bot.handle_text(1, {'id': 1}, text)
+    
+    assert conn.executed == ['EXECUTE registration_step']
+    assert conn.commits == 1
+
+
+def test_text_outside_registration_is_one_round_trip(monkeypatch, bot):
+    conn = use_connection(monkeypatch, bot, {})
+    
+    bot.handle_text(1, {'id': 1}, 'привет')
+    
+    assert conn.executed == ['EXECUTE registration_step']
+
+
+@pytest.mark.parametrize('photo, video, upload', [
+    ([{'file_id': 'p'}], None, {'step': 'photo', 'user_id': 7, 'photos': 0, 'videos': 0, 'inserted': True}),
+    ([{'file_id': 'p'}], None, {'step': 'photo', 'user_id': 7, 'photos': 1, 'videos': 0, 'inserted': True}),
+    ([{'file_id': 'p'}], None, {'step': 'photo', 'user_id': 7, 'photos': 2, 'videos': 0, 'inserted': False}),
+    (None, {'file_id': 'v'}, {'step': 'video', 'user_id': 7, 'photos': 2, 'videos': 0, 'inserted': True}),
+    (None, {'file_id': 'v'}, {'step': 'video', 'user_id': 7, 'photos': 2, 'videos': 1, 'inserted': False}),
+])
+def test_media_upload_is_one_round_trip(monkeypatch, bot, photo, video, upload):
+    conn = use_connection(monkeypatch, bot, {'media_upload': upload})
+    
+    bot.handle_media(1, {'id': 1}, photo, video)
+    
+    assert conn.executed == ['EXECUTE media_upload']
+    assert conn.commits == 1
+
+
+def test_finish_registration_is_one_round_trip(monkeypatch, bot):
+    conn = use_connection(monkeypatch, bot, {'finish_registration': {'user_id': 7}})
+    
+    bot.handle_callback({'id': 'q', 'data': 'finish_registration', 'from': {'id': 1}, 'message': {'chat': {'id': 1}}})
+    
+    assert conn.executed == ['EXECUTE finish_registration']
+    assert conn.commits == 1
+
+
+def test_cold_connection_prepares_once(monkeypatch, bot):
+    conn = use_connection(monkeypatch, bot, {'registration_step': {'step': 'bio', 'next_step': 'photo'}}, warm=False)
+    
+    bot.handle_text(1, {'id': 1}, 'Люблю горы')
+    bot.handle_text(1, {'id': 1}, 'Люблю горы')
+    
+    assert conn.executed == ['PREPARE registration_step', 'EXECUTE registration_step', 'EXECUTE registration_step']
@@ -0,0 +1,199 @@
+"""Шардированный режим бота: несколько процессов-воркеров и синтетический поток обновлений.
+
+Каждый пользователь обрабатывается одним воркером независимо от того, на какой воркер пришло
+обновление; после остановки воркера переезжают только его пользователи. Обновления без chat
+проходят антифлуд и отметку активности в базе, но не вызывают Bot API.
+
+    TEST_DATABASE_URL=postgresql://... python backend/tests/test_shard_stream.py [--workers N] [--users N]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import pytest
+
+import support
+
+SHARD_SCHEMA = f"{support.TEST_DB_SCHEMA}_shards"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_workers(count: int) -> dict:
+    """Процессы-воркеры index.py: {worker_id: (url, процесс)}"""
+    urls = {f"w{index}": f"http://127.0.0.1:{free_port()}" for index in range(1, count + 1)}
+    env = dict(os.environ)
+    env.update({
+        'BOT_SHARD_WORKERS': ','.join(f"{worker_id}={url}" for worker_id, url in urls.items()),
+        'DATABASE_URL': support.schema_dsn(support.TEST_DATABASE_URL, SHARD_SCHEMA),
+        'MAIN_DB_SCHEMA': SHARD_SCHEMA,
+        'FLOOD_RATE': '1000',
+        'FLOOD_BURST': '1000',
+    })
+    env.pop('TELEGRAM_BOT_TOKEN', None)
+    
+    workers = {}
+    for worker_id, url in urls.items():
+        env.update({'BOT_WORKER_ID': worker_id, 'PORT': url.rsplit(':', 1)[1]})
+        process = subprocess.Popen(
+            [sys.executable, 'index.py'],
+            cwd=support.BACKEND_DIR / 'telegram-bot',
+            env=dict(env),
+            stdout=subprocess.DEVNULL
+        )
+        workers[worker_id] = (url, process)
+    
+    for url, process in workers.values():
+        port = int(url.rsplit(':', 1)[1])
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError(f"worker on port {port} did not start")
+                time.sleep(0.05)
+    return workers
+
+
+def stop_workers(workers: dict):
+    for _, process in workers.values():
+        process.terminate()
+    for _, process in workers.values():
+        process.wait(timeout=10)
+
+
+def send_stream(http, entry_urls: list, user_ids: list, rounds: int) -> dict:
+    """Поток обновлений в случайный воркер-вход: {telegram_id: множество обработавших воркеров}"""
+    handled_by = {}
+    updates = [user_id for user_id in user_ids for _ in range(rounds)]
+    random.shuffle(updates)
+    for user_id in updates:
+        resp = http.request(
+            'POST',
+            random.choice(entry_urls),
+            body=json.dumps({'update_id': user_id, 'message': {'from': {'id': user_id}}}).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        assert resp.status == 200, resp.data
+        handled_by.setdefault(user_id, set()).add(resp.headers.get('X-LeoMatch-Worker'))
+    return handled_by
+
+
+def run_stream(workers: int = 3, users: int = 300, rounds: int = 3) -> dict:
+    """Поток до и после остановки одного воркера; возвращает владельцев по обоим проходам"""
+    import urllib3
+    
+    conn = support.connect(schema=SHARD_SCHEMA)
+    support.create_schema(conn, SHARD_SCHEMA)
+    conn.close()
+    
+    bot = support.load_function('telegram-bot', 'telegram_bot_shards')
+    http = urllib3.PoolManager(timeout=urllib3.Timeout(connect=3.0, read=30.0), retries=False)
+    user_ids = [2000000000 + index for index in range(users)]
+    
+    running = start_workers(workers)
+    try:
+        ring = bot.build_shard_ring(running)
+        before = send_stream(http, [url for url, _ in running.values()], user_ids, rounds)
+        
+        stopped = sorted(running)[-1]
+        url, process = running.pop(stopped)
+        process.terminate()
+        process.wait(timeout=10)
+        after = send_stream(http, [url for url, _ in running.values()], user_ids, rounds)
+    finally:
+        stop_workers(running)
+    
+    return {
+        'expected_before': {user_id: bot.shard_owner(user_id, ring) for user_id in user_ids},
+        'expected_after': {user_id: bot.shard_owner(user_id, ring, {stopped}) for user_id in user_ids},
+        'before': before,
+        'after': after,
+        'stopped': stopped,
+    }
+
+
+@pytest.mark.skipif(not support.TEST_DATABASE_URL, reason='TEST_DATABASE_URL is not set')
+def test_stream_keeps_owners_and_moves_only_stopped_worker_users():
+    pytest.importorskip('psycopg2')
+    pytest.importorskip('urllib3')
+    result = run_stream()
+    
+    assert result['before'] == {user_id: {owner} for user_id, owner in result['expected_before'].items()}
+    assert result['after'] == {user_id: {owner} for user_id, owner in result['expected_after'].items()}
+    moved = {user_id for user_id, owner in result['expected_before'].items() if result['expected_after'][user_id] != owner}
+    assert moved == {user_id for user_id, owner in result['expected_before'].items() if owner == result['stopped']}
+
+
+def test_owner_timeout_is_not_processed_locally(monkeypatch):
+    urllib3 = pytest.importorskip('urllib3')
+    bot = support.load_function('telegram-bot', 'telegram_bot_shard_timeout')
+    monkeypatch.setattr(bot, 'SHARD_WORKERS', {'w1': 'http://w1', 'w2': 'http://w2'})
+    monkeypatch.setattr(bot, 'SHARD_WORKER_ID', 'w1')
+    monkeypatch.setattr(bot, '_shard_ring', bot.build_shard_ring(['w2']))
+    
+    class TimingOut:
+        def request(self, *args, **kwargs):
+            raise urllib3.exceptions.ReadTimeoutError(None, 'http://w2', 'Read timed out.')
+    
+    monkeypatch.setattr(bot, 'get_http', lambda: TimingOut())
+    monkeypatch.setattr(bot, 'allow_update', lambda sender_id: pytest.fail('update was processed locally'))
+    
+    result = bot.handler({'httpMethod': 'POST', 'body': json.dumps({'message': {'from': {'id': 7}}})}, None)
+    
+    assert result['statusCode'] == 200
+    assert bot._shard_down == {}
+
+
+def test_unreachable_owner_is_processed_by_next_worker(monkeypatch):
+    urllib3 = pytest.importorskip('urllib3')
+    bot = support.load_function('telegram-bot', 'telegram_bot_shard_refused')
+    monkeypatch.setattr(bot, 'SHARD_WORKERS', {'w1': 'http://w1', 'w2': 'http://w2'})
+    monkeypatch.setattr(bot, 'SHARD_WORKER_ID', 'w1')
+    monkeypatch.setattr(bot, '_shard_ring', bot.build_shard_ring(['w1', 'w2']))
+    sender_id = next(user_id for user_id in range(1000) if bot.shard_owner(user_id, bot._shard_ring) == 'w2')
+    
+    class Refusing:
+        def request(self, *args, **kwargs):
+            raise urllib3.exceptions.NewConnectionError(None, 'Connection refused')
+    
+    monkeypatch.setattr(bot, 'get_http', lambda: Refusing())
+    
+    assert bot.forward_to_owner(sender_id, '{}') is None
+    assert set(bot._shard_down) == {'w2'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=3, help='обновлений на пользователя в каждом проходе')
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    result = run_stream(args.workers, args.users, args.rounds)
+    elapsed = time.perf_counter() - started
+    
+    for phase in ('before', 'after'):
+        split = [user_id for user_id, owners in result[phase].items() if len(owners) != 1]
+        wrong = [user_id for user_id, owners in result[phase].items() if owners != {result[f"expected_{phase}"][user_id]}]
+        load = Counter(next(iter(owners)) for owners in result[phase].values() if len(owners) == 1)
+        print(f"{phase:<7} users per worker: {dict(sorted(load.items()))}; split: {len(split)}, unexpected owner: {len(wrong)}")
+    moved = sum(1 for user_id, owner in result['expected_before'].items() if result['expected_after'][user_id] != owner)
+    print(f"stopped {result['stopped']}: {moved} of {args.users} users moved; {elapsed:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+-- Поиск пользователей в админ-панели: триграммы и полнотекстовый вектор
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Имя и username: GiST для выборки ближайших по триграммам (ORDER BY ... <->> LIMIT) без ранжирования
+-- всех совпадений. Usernames почти уникальны и похожи друг на друга: с длинной сигнатурой индекс
+-- отсекает неподходящие ветки, а не обходит их
+CREATE INDEX IF NOT EXISTS idx_users_first_name_trgm ON users USING GIST (first_name gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIST (username gist_trgm_ops(siglen=256));
+
+-- Город: различных значений мало, и у всех анкет города расстояние одинаковое — выборка ближайших
+-- по GiST обходила бы почти весь индекс, поэтому GIN
+CREATE INDEX IF NOT EXISTS idx_users_city_trgm ON users USING GIN (city gin_trgm_ops);
+
+-- Вектор по всем полям анкеты хранится в строке и пересчитывается при изменении анкеты;
+-- описание ищется только по словам
+ALTER TABLE users ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(username, '') || ' ' || coalesce(city, '') || ' ' || coalesce(bio, ''))
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_users_search_vector ON users USING GIN (search_vector);
@@ -0,0 +1,8 @@
+-- Общие token bucket'ы антифлуда для нескольких экземпляров бота.
+-- UNLOGGED: таблица не пишется в WAL и очищается после сбоя — для лимитов это допустимо
+CREATE UNLOGGED TABLE IF NOT EXISTS flood_buckets (
+    telegram_id BIGINT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    allowed BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,33 @@
+-- Индексы для горячих запросов бота и админ-панели
+
+-- Пул активных анкет: подбор кандидатов в show_next_profile идет по id без сортировки
+CREATE INDEX IF NOT EXISTS idx_users_active ON users(id) WHERE status = 'active';
+
+-- Списки пользователей в админ-панели (фильтр по статусу, новые сверху)
+CREATE INDEX IF NOT EXISTS idx_users_status_created ON users(status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at DESC);
+DROP INDEX IF EXISTS idx_users_status;
+
+-- Очередь модерации в статистике; условие должно совпадать с запросом admin-api
+CREATE INDEX IF NOT EXISTS idx_users_moderation_queue ON users(id)
+    WHERE status = 'pending' OR (status = 'active' AND verified = FALSE);
+
+-- Дубликат индекса уникального ограничения на telegram_id
+DROP INDEX IF EXISTS idx_users_telegram_id;
+
+-- Медиа анкеты в порядке показа (ORDER BY media_type, position)
+CREATE INDEX IF NOT EXISTS idx_user_media_user_type_position ON user_media(user_id, media_type, position);
+DROP INDEX IF EXISTS idx_user_media_user_id;
+
+-- Дубликат индекса уникального ограничения (from_user_id, to_user_id)
+DROP INDEX IF EXISTS idx_user_reactions_from_user;
+
+-- Матчи: второй участник (проверка внешнего ключа при удалении анкеты), списки и статистика
+CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches(user2_id);
+CREATE INDEX IF NOT EXISTS idx_matches_status_created ON matches(status, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_matches_created ON matches(created_at);
+
+-- Сообщения матча в хронологическом порядке и отправитель (внешний ключ)
+CREATE INDEX IF NOT EXISTS idx_messages_match_created ON messages(match_id, created_at DESC);
+DROP INDEX IF EXISTS idx_messages_match;
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender_id);
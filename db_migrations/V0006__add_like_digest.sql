@@ -0,0 +1,13 @@
+-- Дайджест входящих лайков: водяные знаки для инкрементальной рассылки
+
+-- Момент, до которого пользователь уже получил дайджест лайков
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_digest_at TIMESTAMP;
+
+-- Водяные знаки плановых задач: до какого момента данные полностью обработаны
+CREATE TABLE IF NOT EXISTS job_watermarks (
+    job VARCHAR(50) PRIMARY KEY,
+    last_run_at TIMESTAMP NOT NULL
+);
+
+-- Выборка только новых лайков с прошлого полного запуска
+CREATE INDEX IF NOT EXISTS idx_user_reactions_likes_created ON user_reactions(created_at) WHERE reaction_type = 'like';
@@ -0,0 +1,91 @@
+-- Справочник городов: сравнение городов по целочисленному city_id вместо строк
+
+CREATE TABLE IF NOT EXISTS cities (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE
+);
+
+-- Варианты написания города в нормализованном виде (см. normalize_city)
+CREATE TABLE IF NOT EXISTS city_aliases (
+    alias VARCHAR(255) PRIMARY KEY,
+    city_id INTEGER NOT NULL REFERENCES cities(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_city_aliases_trgm ON city_aliases USING GIN (alias gin_trgm_ops);
+
+-- Нормализация: нижний регистр, ё -> е, без префикса "г."/"город", дефисы и пробелы схлопнуты
+CREATE OR REPLACE FUNCTION normalize_city(raw TEXT) RETURNS TEXT AS $$
+    SELECT btrim(regexp_replace(
+        regexp_replace(replace(lower(btrim(raw)), 'ё', 'е'), '^(г\.\s*|город\s+)', ''),
+        '[\s-]+', ' ', 'g'
+    ))
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Город по введенному тексту: точное совпадение варианта, затем ближайший по триграммам,
+-- иначе новый город. Найденный вариант написания запоминается
+CREATE OR REPLACE FUNCTION resolve_city(raw TEXT) RETURNS INTEGER AS $$
+DECLARE
+    norm TEXT := normalize_city(raw);
+    found_id INTEGER;
+BEGIN
+    IF norm IS NULL OR norm = '' THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT city_id INTO found_id FROM city_aliases WHERE alias = norm;
+    IF found_id IS NOT NULL THEN
+        RETURN found_id;
+    END IF;
+
+    SELECT city_id INTO found_id FROM city_aliases
+    WHERE alias % norm AND similarity(alias, norm) >= 0.5
+    ORDER BY similarity(alias, norm) DESC
+    LIMIT 1;
+
+    IF found_id IS NULL THEN
+        INSERT INTO cities (name) VALUES (initcap(btrim(raw)))
+        ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+        RETURNING id INTO found_id;
+    END IF;
+
+    INSERT INTO city_aliases (alias, city_id) VALUES (norm, found_id)
+    ON CONFLICT (alias) DO NOTHING;
+
+    RETURN found_id;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+-- Крупные города и их частые варианты написания
+INSERT INTO cities (name) VALUES
+    ('Москва'), ('Санкт-Петербург'), ('Новосибирск'), ('Екатеринбург'), ('Казань'),
+    ('Нижний Новгород'), ('Челябинск'), ('Самара'), ('Омск'), ('Ростов-на-Дону'),
+    ('Уфа'), ('Красноярск'), ('Воронеж'), ('Пермь'), ('Волгоград'), ('Краснодар')
+ON CONFLICT (name) DO NOTHING;
+
+INSERT INTO city_aliases (alias, city_id)
+SELECT normalize_city(name), id FROM cities
+ON CONFLICT (alias) DO NOTHING;
+
+INSERT INTO city_aliases (alias, city_id)
+SELECT a.alias, c.id
+FROM (VALUES
+    ('moscow', 'Москва'), ('moskva', 'Москва'), ('мск', 'Москва'), ('msk', 'Москва'),
+    ('спб', 'Санкт-Петербург'), ('питер', 'Санкт-Петербург'), ('петербург', 'Санкт-Петербург'),
+    ('saint petersburg', 'Санкт-Петербург'), ('st petersburg', 'Санкт-Петербург'), ('spb', 'Санкт-Петербург'),
+    ('новосиб', 'Новосибирск'), ('novosibirsk', 'Новосибирск'),
+    ('екб', 'Екатеринбург'), ('екат', 'Екатеринбург'), ('yekaterinburg', 'Екатеринбург'), ('ekaterinburg', 'Екатеринбург'),
+    ('kazan', 'Казань'),
+    ('нн', 'Нижний Новгород'), ('нижний', 'Нижний Новгород'), ('nizhny novgorod', 'Нижний Новгород'),
+    ('chelyabinsk', 'Челябинск'), ('samara', 'Самара'), ('omsk', 'Омск'),
+    ('ростов', 'Ростов-на-Дону'), ('rostov on don', 'Ростов-на-Дону'),
+    ('ufa', 'Уфа'), ('krasnoyarsk', 'Красноярск'), ('voronezh', 'Воронеж'),
+    ('perm', 'Пермь'), ('volgograd', 'Волгоград'), ('krasnodar', 'Краснодар')
+) AS a(alias, name)
+JOIN cities c ON c.name = a.name
+ON CONFLICT (alias) DO NOTHING;
+
+-- Город анкеты; старые анкеты заполняются батчами задачей city_backfill (bot-jobs)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS city_id INTEGER REFERENCES cities(id);
+
+-- Подбор кандидатов из того же города
+CREATE INDEX IF NOT EXISTS idx_users_active_city ON users(city_id, id) WHERE status = 'active';
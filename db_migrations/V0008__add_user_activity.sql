@@ -0,0 +1,10 @@
+-- Учет активности: время последнего обращения к боту и автоматический перевод в 'dormant'
+
+-- Момент последнего обновления от пользователя (пишется не чаще раза в интервал).
+-- Когда существующие пользователи обращались к боту, не записывалось (updated_at анкета до сих пор
+-- не обновляла), поэтому их отсчет начинается с наката миграции: значение по умолчанию
+-- вычисляется один раз и не переписывает таблицу
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+-- Поиск давно неактивных анкет в активном пуле плановой задачей dormancy
+CREATE INDEX IF NOT EXISTS idx_users_active_last_seen ON users(last_seen_at) WHERE status = 'active';
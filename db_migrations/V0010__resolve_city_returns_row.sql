@@ -0,0 +1,58 @@
+-- resolve_city возвращает строку справочника (id, name), а не только id.
+-- Новый город, созданный функцией, не виден из снимка вызывающего запроса: найти его
+-- в cities по id тем же запросом нельзя, поэтому название берется из результата функции.
+--
+-- Справочник пополняется осторожно, текст вводят пользователи:
+-- * нечеткое совпадение ищется только среди вариантов с тем же числом слов ("Новгород" — не "Нижний Новгород")
+--   и запоминается как новый вариант написания, только если почти не отличается от него;
+-- * новый город создается только из букв, пробелов и дефисов разумной длины и без отрицания "не"
+--   (эмодзи, случайный длинный текст, "не скажу") — иначе NULL, и в анкете остается введенный текст без city_id
+
+DROP FUNCTION IF EXISTS resolve_city(TEXT);
+
+CREATE FUNCTION resolve_city(raw TEXT) RETURNS cities AS $$
+DECLARE
+    norm TEXT := normalize_city(raw);
+    norm_words INTEGER := array_length(string_to_array(norm, ' '), 1);
+    match_threshold CONSTANT REAL := 0.55;
+    alias_threshold CONSTANT REAL := 0.8;
+    max_length CONSTANT INTEGER := 100;
+    resolved cities;
+    matched_id INTEGER;
+    score REAL;
+BEGIN
+    IF norm IS NULL OR norm = '' OR char_length(norm) > max_length THEN
+        RETURN NULL;
+    END IF;
+
+    SELECT c.* INTO resolved FROM city_aliases a JOIN cities c ON c.id = a.city_id WHERE a.alias = norm;
+    IF FOUND THEN
+        RETURN resolved;
+    END IF;
+
+    SELECT city_id, similarity(alias, norm) INTO matched_id, score FROM city_aliases
+    WHERE alias % norm
+    AND similarity(alias, norm) >= match_threshold
+    AND array_length(string_to_array(alias, ' '), 1) = norm_words
+    ORDER BY similarity(alias, norm) DESC
+    LIMIT 1;
+
+    IF FOUND THEN
+        SELECT * INTO resolved FROM cities WHERE id = matched_id;
+        IF score < alias_threshold THEN
+            RETURN resolved;
+        END IF;
+    ELSIF norm ~ '^[[:alpha:]]+( [[:alpha:]]+)*$' AND NOT 'не' = ANY(string_to_array(norm, ' ')) THEN
+        INSERT INTO cities (name) VALUES (initcap(btrim(raw)))
+        ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+        RETURNING * INTO resolved;
+    ELSE
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO city_aliases (alias, city_id) VALUES (norm, resolved.id)
+    ON CONFLICT (alias) DO NOTHING;
+
+    RETURN resolved;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
@@ -0,0 +1,5 @@
+-- Отметка активности (touch_last_seen) пишется при каждом обращении пользователя к боту.
+-- Пока last_seen_at в индексе, такое обновление не может быть HOT и переписывает все индексы
+-- users, включая GIN. Задача dormancy проходит активный пул по idx_users_active без этого индекса
+
+DROP INDEX IF EXISTS idx_users_active_last_seen;